@@ -1,13 +1,29 @@
 from runner.utils import parse_arguments
 from runner.runner import ExperimentRunner
 from experiment.experiment import Experiment
+from experiment.index import rebuild_index
 
 if __name__ == "__main__":
     args = parse_arguments()
     if args.experiment:
-        runner = ExperimentRunner(manifest=args.experiment)
+        runner = ExperimentRunner(
+            manifest=args.experiment,
+            workers=args.workers,
+            parse=args.parse,
+            resume=args.resume,
+            force=args.force,
+        )
         runner.execute()
     elif args.create:
         experiment = Experiment(path=args.create, create=True)
-    # elif args.plot:
-    #    plot_results(args.plot)
+    elif args.index:
+        rebuild_index(path=args.index).close()
+    elif args.plot:
+        # the plotting dependencies are only loaded when needed
+        from processing.diefficiency import plot_results
+
+        plot_results(
+            path=args.plot,
+            max_points=args.plot_points,
+            per_query=args.plot_per_query,
+        )
@@ -0,0 +1,33 @@
+from sys import argv, stdout
+from json import dumps, loads
+from time import monotonic_ns, sleep
+from urllib.request import urlopen
+
+# A synthetic engine with the same command line as the Comunica binaries, which
+# fetches the sources in the context and then prints bindings at a controlled rate
+# and size. Every binding contains the time it was printed on the monotonic clock,
+# which is shared with the harness, as the ground truth for its arrival time.
+
+if __name__ == "__main__":
+    context = loads(argv[argv.index("--context") + 1]) if "--context" in argv else {}
+    for source in context.get("sources", []):
+        with urlopen(source) as response:
+            response.read()
+    bindings: int = context.get("bindings", 1000)
+    interval: int = int(1e9 / context["rate"]) if context.get("rate") else 0
+    padding: str = "x" * context.get("size", 0)
+    stdout.write("[\n")
+    stdout.flush()
+    ns_begin: int = monotonic_ns()
+    for i in range(0, bindings):
+        if interval:
+            delay: int = ns_begin + i * interval - monotonic_ns()
+            if delay > 0:
+                sleep(delay / 1e9)
+        stdout.write(
+            dumps({"emitted": str(monotonic_ns()), "padding": padding})
+            + (",\n" if i < bindings - 1 else "\n")
+        )
+        stdout.flush()
+    stdout.write("]\n")
+    stdout.flush()
@@ -0,0 +1,265 @@
+from json import dumps
+from pathlib import Path
+from sys import executable
+from time import perf_counter, perf_counter_ns
+from datetime import timedelta
+from argparse import ArgumentParser
+from logging import basicConfig, WARNING
+from typing import Any, Dict, IO, Iterable, List, Tuple
+
+from experiment.result import Result
+
+from runner.outputparser import PARSE_MODES, OutputParser
+from runner.proxyserver import ProxyServer
+from runner.queryengine import QueryEngine
+
+from benchmark.proxy import get_percentiles, measure_latencies
+from benchmark.upstream import SyntheticUpstream
+
+ENGINE: Path = Path(__file__).parent.joinpath("engine.py")
+
+
+class GroundTruthQueryEngine(QueryEngine):
+    """Query engine that exposes the start of its clock and the time spent parsing"""
+
+    def __init__(self, context: Dict[str, Any], parse: str) -> None:
+        super().__init__(
+            cwd=ENGINE.parent,
+            bin=ENGINE,
+            node=Path(executable),
+            env={},
+            context=context,
+            parse=parse,
+            sample_interval=0,
+        )
+        self.ns_start: int = 0
+        self.ns_parse: int = 0
+
+    def read_output(
+        self,
+        stdout: IO[bytes],
+        parser: OutputParser,
+        result: Result,
+        ns_start: int,
+        rebase: Tuple[str, str] | None,
+    ) -> Tuple[List[Tuple[int, bytes]], bool]:
+        # the arrival times are relative to this point on the monotonic clock
+        self.ns_start = ns_start
+        return super().read_output(stdout, parser, result, ns_start, rebase)
+
+    def parse_output(
+        self,
+        lines: Iterable[Tuple[int, bytes]],
+        parser: OutputParser,
+        result: Result,
+        rebase: Tuple[str, str] | None,
+    ) -> None:
+        ns_parse: int = perf_counter_ns()
+        super().parse_output(lines, parser, result, rebase)
+        self.ns_parse += perf_counter_ns() - ns_parse
+
+
+def get_milliseconds(values: Iterable[float], scale: float) -> Dict[str, float]:
+    percentiles: Dict[str, float] = get_percentiles(list(v * scale for v in values))
+    return {key: round(value, 3) for key, value in percentiles.items()}
+
+
+def measure_engine(
+    proxy_server: ProxyServer,
+    documents: int,
+    parse: str,
+    bindings: int,
+    rate: int,
+    size: int,
+) -> Dict[str, Any]:
+    """Compare the arrival times recorded by the harness to when they were printed"""
+    engine: GroundTruthQueryEngine = GroundTruthQueryEngine(
+        context={
+            "sources": list(
+                f"{proxy_server.get_listen_base()}/document/{i}"
+                for i in range(0, documents)
+            ),
+            "bindings": bindings,
+            "rate": rate,
+            "size": size,
+        },
+        parse=parse,
+    )
+    result: Result = engine.query_bindings(
+        query_id="benchmark",
+        query_string="",
+        timeout=timedelta(seconds=60 + (bindings / rate if rate else 0)),
+        config_path=ENGINE,
+    )
+    if result.get_result_count() != bindings or result.timeout:
+        raise Exception(
+            f"Received {result.get_result_count()} / {bindings} bindings: "
+            + "\n".join(line for _, line in result.stderr)
+        )
+    emitted: List[int] = []
+    received: List[int] = []
+    for timestamp, binding in result.get_results():
+        emitted.append(int(binding["emitted"]))
+        received.append(engine.ns_start + timestamp)
+    emitted_seconds: float = (max(emitted) - min(emitted)) / 1e9
+    received_seconds: float = (max(received) - min(received)) / 1e9
+    return {
+        "parse": parse,
+        "rate": rate,
+        "size": size,
+        "bindings": bindings,
+        "skew_ms": get_milliseconds((r - e for r, e in zip(received, emitted)), 1e-6),
+        # With an unlimited rate, the engine is held back by the harness reading
+        # its output, so these are the throughput ceilings of the harness
+        "engine_bindings_per_second": (
+            round(bindings / emitted_seconds) if emitted_seconds > 0 else None
+        ),
+        "harness_bindings_per_second": (
+            round(bindings / received_seconds) if received_seconds > 0 else None
+        ),
+        "parse_us_per_binding": round(engine.ns_parse / bindings / 1000, 3),
+    }
+
+
+def measure_proxy(
+    upstream: SyntheticUpstream, concurrency: int, requests: int
+) -> Dict[str, Any]:
+    """Latency added by the proxy compared to requesting the upstream directly"""
+    direct: List[float] = measure_latencies(upstream.port, concurrency, requests)
+    proxy_server: ProxyServer = ProxyServer(
+        host="localhost",
+        port=0,
+        upstream_host=upstream.host,
+        upstream_port=upstream.port,
+        pool_size=max(concurrency, 16),
+    )
+    proxy_server.start()
+    time_start: float = perf_counter()
+    proxied: List[float] = measure_latencies(proxy_server.port, concurrency, requests)
+    time_taken: float = perf_counter() - time_start
+    proxy_server.stop()
+    direct_ms: Dict[str, float] = get_milliseconds(direct, 1000)
+    proxied_ms: Dict[str, float] = get_milliseconds(proxied, 1000)
+    return {
+        "concurrency": concurrency,
+        "requests": len(proxied),
+        "added_latency_ms": {
+            key: round(proxied_ms[key] - direct_ms[key], 3) for key in proxied_ms
+        },
+        "proxied_latency_ms": proxied_ms,
+        "requests_per_second": round(len(proxied) / time_taken),
+    }
+
+
+def run_benchmarks(
+    bindings: int,
+    rates: List[int],
+    size: int,
+    parse_modes: List[str],
+    documents: int,
+    document_size: int,
+    latency: float,
+    concurrency_levels: List[int],
+    requests: int,
+    output: Path | None,
+) -> None:
+    upstream: SyntheticUpstream = SyntheticUpstream(
+        host="localhost",
+        port=0,
+        size=document_size,
+        latency=latency,
+        documents=documents,
+    )
+    upstream.start()
+    proxy_server: ProxyServer = ProxyServer(
+        host="localhost",
+        port=0,
+        upstream_host=upstream.host,
+        upstream_port=upstream.port,
+    )
+    proxy_server.start()
+    engine_results: List[Dict[str, Any]] = []
+    print(f"Timestamp skew in ms over {bindings} bindings of {size} bytes")
+    print(
+        f"{'parse':<9} {'rate':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+        f"{'engine/s':>9} {'harness/s':>9} {'parse us':>8}"
+    )
+    for parse in parse_modes:
+        for rate in rates:
+            measured: Dict[str, Any] = measure_engine(
+                proxy_server, documents, parse, bindings, rate, size
+            )
+            engine_results.append(measured)
+            skew: Dict[str, float] = measured["skew_ms"]
+            print(
+                f"{parse:<9} {rate or 'max':>7} {skew['p50']:>8.3f} "
+                f"{skew['p95']:>8.3f} {skew['p99']:>8.3f} {skew['max']:>8.3f} "
+                f"{measured['engine_bindings_per_second']:>9} "
+                f"{measured['harness_bindings_per_second']:>9} "
+                f"{measured['parse_us_per_binding']:>8.3f}"
+            )
+    proxy_server.stop()
+    upstream.stop()
+    # every client requests a different document each time, so they are not limited
+    upstream = SyntheticUpstream(
+        host="localhost", port=0, size=document_size, latency=latency
+    )
+    upstream.start()
+    proxy_results: List[Dict[str, Any]] = []
+    print(
+        f"Proxy added latency in ms over {requests} requests per client, "
+        f"{document_size} bytes"
+    )
+    print(f"{'clients':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'req/s':>8}")
+    for concurrency in concurrency_levels:
+        measured = measure_proxy(upstream, concurrency, requests)
+        proxy_results.append(measured)
+        added: Dict[str, float] = measured["added_latency_ms"]
+        print(
+            f"{concurrency:>7} {added['p50']:>8.3f} {added['p95']:>8.3f} "
+            f"{added['p99']:>8.3f} {added['max']:>8.3f} "
+            f"{measured['requests_per_second']:>8}"
+        )
+    upstream.stop()
+    if output:
+        # the numbers can be compared between versions to spot regressions
+        with open(output, "w") as output_file:
+            output_file.write(
+                dumps({"engine": engine_results, "proxy": proxy_results}, indent=2)
+            )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Measure the overhead of the harness on the measured timings"
+    )
+    parser.add_argument("--bindings", type=int, default=2000)
+    parser.add_argument(
+        "--rates",
+        type=int,
+        nargs="+",
+        default=[0, 10000, 1000],
+        help="Bindings per second printed by the engine, or 0 for unlimited",
+    )
+    parser.add_argument("--size", type=int, default=100, help="Binding padding")
+    parser.add_argument("--parse", choices=PARSE_MODES, nargs="+", default=PARSE_MODES)
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--document-size", type=int, default=16 * 1024)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--output", type=Path, help="Path to write the numbers into")
+    args = parser.parse_args()
+    basicConfig(level=WARNING)
+    run_benchmarks(
+        bindings=args.bindings,
+        rates=args.rates,
+        size=args.size,
+        parse_modes=args.parse,
+        documents=args.documents,
+        document_size=args.document_size,
+        latency=args.latency,
+        concurrency_levels=args.concurrency,
+        requests=args.requests,
+        output=args.output,
+    )
@@ -0,0 +1,98 @@
+from time import perf_counter
+from argparse import ArgumentParser
+from logging import basicConfig, WARNING
+from threading import Thread
+from statistics import quantiles
+from http.client import HTTPConnection
+from typing import Dict, List, Type
+
+from runner.proxyserver import BaseProxyServer, ProxyServer
+from runner.asyncproxyserver import AsyncProxyServer
+
+from benchmark.upstream import SyntheticUpstream
+
+PROXY_SERVERS: Dict[str, Type[BaseProxyServer]] = {
+    "threading": ProxyServer,
+    "asyncio": AsyncProxyServer,
+}
+
+
+def measure_latencies(port: int, concurrency: int, requests: int) -> List[float]:
+    latencies: List[float] = []
+
+    def request_sequentially() -> None:
+        connection: HTTPConnection = HTTPConnection("localhost", port)
+        for i in range(0, requests):
+            time_start: float = perf_counter()
+            connection.request("GET", f"/document/{i}")
+            connection.getresponse().read()
+            latencies.append(perf_counter() - time_start)
+        connection.close()
+
+    threads: List[Thread] = list(
+        Thread(target=request_sequentially) for _ in range(0, concurrency)
+    )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def get_percentiles(values: List[float]) -> Dict[str, float]:
+    # the inclusive method keeps the percentiles within the measured values
+    cuts: List[float] = (
+        quantiles(values, n=100, method="inclusive") if len(values) > 1 else values * 99
+    )
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(values)}
+
+
+def format_percentiles(latencies: List[float]) -> str:
+    return " ".join(f"{v * 1000:>8.3f}" for v in get_percentiles(latencies).values())
+
+
+def compare_proxy_servers(
+    concurrency_levels: List[int], requests: int, size: int, latency: float
+) -> None:
+    upstream: SyntheticUpstream = SyntheticUpstream(
+        host="localhost", port=0, size=size, latency=latency
+    )
+    upstream.start()
+    print(f"Proxy latency in ms over {requests} requests per client, {size} bytes")
+    print(f"{'server':<10} {'clients':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for concurrency in concurrency_levels:
+        direct: List[float] = measure_latencies(upstream.port, concurrency, requests)
+        print(f"{'direct':<10} {concurrency:>7} {format_percentiles(direct)}")
+        for name, proxy_server_type in PROXY_SERVERS.items():
+            proxy_server: BaseProxyServer = proxy_server_type(
+                host="localhost",
+                port=0,
+                upstream_host=upstream.host,
+                upstream_port=upstream.port,
+                pool_size=max(concurrency, 16),
+            )
+            proxy_server.start()
+            proxied: List[float] = measure_latencies(
+                proxy_server.port, concurrency, requests
+            )
+            proxy_server.stop()
+            print(f"{name:<10} {concurrency:>7} {format_percentiles(proxied)}")
+    upstream.stop()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Compare the latency overhead of the proxy server implementations"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--size", type=int, default=16 * 1024)
+    parser.add_argument("--latency", type=float, default=0)
+    args = parser.parse_args()
+    basicConfig(level=WARNING)
+    compare_proxy_servers(
+        concurrency_levels=args.concurrency,
+        requests=args.requests,
+        size=args.size,
+        latency=args.latency,
+    )
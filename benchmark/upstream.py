@@ -0,0 +1,66 @@
+from time import sleep
+from threading import Thread
+from logging import debug, info
+from typing import Any
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from runner.proxyserver import LISTEN_BACKLOG
+
+
+class SyntheticUpstream:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int,
+        latency: float,
+        documents: int | None = None,
+    ) -> None:
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
+            (host, port), BaseHTTPRequestHandler, bind_and_activate=False
+        )
+        self.server.request_queue_size = LISTEN_BACKLOG
+        self.server.server_bind()
+        self.server.server_activate()
+        self.host: str = host
+        self.port: int = self.server.server_address[1]
+        self.base: str = f"http://{host}:{self.port}"
+        # The document refers to the upstream itself, so the proxy has to rewrite it
+        line: bytes = f"<{self.base}/s> <{self.base}/p> <{self.base}/o> .\n".encode()
+        document: bytes = line * (size // len(line) + 1)
+        document = document[:size]
+
+        class SyntheticHTTPRequestHandler(BaseHTTPRequestHandler):
+            protocol_version: str = "HTTP/1.1"
+            disable_nagle_algorithm: bool = True
+
+            def do_GET(self) -> None:
+                if latency > 0:
+                    sleep(latency)
+                # only the documents up to the document count exist, if limited
+                _, _, document_index = self.path.rpartition("/")
+                if documents is not None and not (
+                    document_index.isdigit() and int(document_index) < documents
+                ):
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/n-triples")
+                self.send_header("Content-Length", str(len(document)))
+                self.end_headers()
+                self.wfile.write(document)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                debug(format, *args)
+
+        self.server.RequestHandlerClass = SyntheticHTTPRequestHandler
+        self.thread: Thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        info(f"Started synthetic upstream at <{self.base}>")
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
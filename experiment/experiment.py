@@ -19,17 +19,43 @@ class Experiment:
             "queries": [p.as_posix() for p in self.queries],
             "configs": [p.as_posix() for p in self.configs],
             "replication": self.replication,
+            "replication_mode": self.replication_mode,
+            "replication_min": self.replication_min,
+            "replication_confidence_target": self.replication_confidence_target,
+            "replication_timeout_limit": self.replication_timeout_limit,
+            "schedule": self.schedule,
+            "schedule_seed": self.schedule_seed,
             "results": self.results.as_posix(),
+            "results_format": self.results_format,
+            "metrics_host": self.metrics_host,
+            "metrics_port": self.metrics_port,
             "query_engine_cwd": self.query_engine_cwd.as_posix(),
             "query_engine_bin": self.query_engine_bin.as_posix(),
             "query_engine_node": self.query_engine_node.as_posix(),
             "query_engine_timeout": self.query_engine_timeout,
             "query_engine_context": self.query_engine_context,
             "query_engine_environment": self.query_engine_environment,
+            "query_engine_mode": self.query_engine_mode,
+            "query_engine_output_format": self.query_engine_output_format,
+            "query_engine_stderr_lines": self.query_engine_stderr_lines,
+            "query_engine_sample_interval": self.query_engine_sample_interval,
+            "query_engine_profile": self.query_engine_profile,
+            "query_engine_worker": (
+                self.query_engine_worker.as_posix()
+                if self.query_engine_worker
+                else None
+            ),
             "proxy_server_host": self.proxy_server_host,
             "proxy_server_port": self.proxy_server_port,
             "proxy_server_upstream_host": self.proxy_server_upstream_host,
             "proxy_server_upstream_port": self.proxy_server_upstream_port,
+            "proxy_server_implementation": self.proxy_server_implementation,
+            "proxy_server_pool_size": self.proxy_server_pool_size,
+            "proxy_server_pool_idle_timeout": self.proxy_server_pool_idle_timeout,
+            "proxy_server_cache_mode": self.proxy_server_cache_mode,
+            "proxy_server_cache_path": self.proxy_server_cache_path.as_posix(),
+            "proxy_server_cache_memory": self.proxy_server_cache_memory,
+            "proxy_server_network": self.proxy_server_network,
         }
 
     def create(self, path: Path) -> None:
@@ -39,12 +65,34 @@ class Experiment:
         self.queries: List[Path] = []
         self.configs: List[Path] = []
         self.replication: int = 3
+        self.replication_mode: str = "fixed"
+        self.replication_min: int = 3
+        self.replication_confidence_target: float = 0.05
+        self.replication_timeout_limit: int = 2
+        self.schedule: str = "manifest"
+        self.schedule_seed: int | None = 0
         self.results: Path = cwd
+        self.results_format: str = "compact"
+        self.metrics_host: str = "localhost"
+        self.metrics_port: int | None = None
         # Proxy server
         self.proxy_server_host: str = "localhost"
         self.proxy_server_port: int = 3000
         self.proxy_server_upstream_host: str = "localhost"
         self.proxy_server_upstream_port: int = 3001
+        self.proxy_server_implementation: str = "threading"
+        self.proxy_server_pool_size: int = 16
+        self.proxy_server_pool_idle_timeout: float = 30
+        self.proxy_server_cache_mode: str = "passthrough"
+        self.proxy_server_cache_path: Path = cwd.joinpath("cache")
+        self.proxy_server_cache_memory: int = 256 * 1024 * 1024
+        self.proxy_server_network: Dict[str, Any] = {
+            "latency": 0,
+            "jitter": 0,
+            "jitter_distribution": "none",
+            "bandwidth": 0,
+            "seed": 0,
+        }
         # Query engine
         self.query_engine_timeout: int = 60
         self.query_engine_cwd: Path = cwd
@@ -55,6 +103,18 @@ class Experiment:
             "NODE_OPTIONS": "--max-old-space-size=8192",
             "NODE_ENV": "production",
         }
+        self.query_engine_mode: str = "cold"
+        self.query_engine_output_format: str = "application/json"
+        self.query_engine_stderr_lines: int = 10000
+        self.query_engine_sample_interval: float = 0.1
+        self.query_engine_profile: Dict[str, Any] = {
+            "queries": [],
+            "configs": [],
+            "fraction": 0,
+            "seed": 0,
+            "flags": [],
+        }
+        self.query_engine_worker: Path | None = None
         # Serialize into file
         with open(path, "w") as manifest_file:
             manifest_file.write(
@@ -69,12 +129,43 @@ class Experiment:
         self.queries: List[Path] = list(Path(p).resolve() for p in data["queries"])
         self.configs: List[Path] = list(Path(p).resolve() for p in data["configs"])
         self.results: Path = Path(data["results"]).resolve()
+        self.results_format: str = data.get("results_format", "compact")
+        # The metrics of a running experiment are only served when a port is set
+        self.metrics_host: str = data.get("metrics_host", "localhost")
+        self.metrics_port: int | None = data.get("metrics_port")
         self.replication: int = data["replication"]
+        # In the adaptive mode, the replication count is the maximum instead
+        self.replication_mode: str = data.get("replication_mode", "fixed")
+        self.replication_min: int = data.get("replication_min", 3)
+        self.replication_confidence_target: float = data.get(
+            "replication_confidence_target", 0.05
+        )
+        self.replication_timeout_limit: int = data.get("replication_timeout_limit", 2)
+        # A null seed is drawn randomly and logged when the experiment starts
+        self.schedule: str = data.get("schedule", "manifest")
+        self.schedule_seed: int | None = data.get("schedule_seed", 0)
         # Proxy server section
         self.proxy_server_host: str = data["proxy_server_host"]
         self.proxy_server_port: int = data["proxy_server_port"]
         self.proxy_server_upstream_host: str = data["proxy_server_upstream_host"]
         self.proxy_server_upstream_port: int = data["proxy_server_upstream_port"]
+        self.proxy_server_implementation: str = data.get(
+            "proxy_server_implementation", "threading"
+        )
+        self.proxy_server_pool_size: int = data.get("proxy_server_pool_size", 16)
+        self.proxy_server_pool_idle_timeout: float = data.get(
+            "proxy_server_pool_idle_timeout", 30
+        )
+        self.proxy_server_cache_mode: str = data.get(
+            "proxy_server_cache_mode", "passthrough"
+        )
+        self.proxy_server_cache_path: Path = Path(
+            data.get("proxy_server_cache_path", self.results.joinpath("cache"))
+        ).resolve()
+        self.proxy_server_cache_memory: int = data.get(
+            "proxy_server_cache_memory", 256 * 1024 * 1024
+        )
+        self.proxy_server_network: Dict[str, Any] = data.get("proxy_server_network", {})
         # Query engine section
         self.query_engine_timeout: int = data["query_engine_timeout"]
         self.query_engine_cwd: Path = Path(data["query_engine_cwd"]).resolve()
@@ -82,6 +173,22 @@ class Experiment:
         self.query_engine_node: Path = Path(data["query_engine_node"]).resolve()
         self.query_engine_context: Dict[str, Any] = data["query_engine_context"]
         self.query_engine_environment: Dict[str, str] = data["query_engine_environment"]
+        self.query_engine_mode: str = data.get("query_engine_mode", "cold")
+        self.query_engine_output_format: str = data.get(
+            "query_engine_output_format", "application/json"
+        )
+        self.query_engine_stderr_lines: int = data.get(
+            "query_engine_stderr_lines", 10000
+        )
+        self.query_engine_sample_interval: float = data.get(
+            "query_engine_sample_interval", 0.1
+        )
+        self.query_engine_profile: Dict[str, Any] = data.get("query_engine_profile", {})
+        self.query_engine_worker: Path | None = (
+            Path(data["query_engine_worker"]).resolve()
+            if data.get("query_engine_worker")
+            else None
+        )
         # Load individual query strings for queries from the files
         self.query_strings: Dict[str, str] = {}
         for query_path in self.queries:
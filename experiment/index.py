@@ -0,0 +1,148 @@
+from pathlib import Path
+from logging import info, error
+from threading import Lock
+from sqlite3 import Connection, Row, connect
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+from experiment.result import (
+    RESULT_HASH_VERSION,
+    RESULT_NAME_PATTERN,
+    Result,
+    load_result,
+)
+
+INDEX_NAME: str = "index.sqlite"
+
+# Columns of the index, with the summary keys they are filled from
+INDEX_COLUMNS: Tuple[Tuple[str, str, str], ...] = (
+    ("path", "TEXT PRIMARY KEY", "path"),
+    ("config", "TEXT", "engine_config"),
+    ("query", "TEXT", "engine_query"),
+    ("replication", "INTEGER", "replication"),
+    ("time_begin", "TEXT", "time_begin"),
+    ("time_end", "TEXT", "time_end"),
+    ("time_taken_seconds", "REAL", "time_taken_seconds"),
+    ("timeout", "INTEGER", "engine_timeout_reached"),
+    ("result_count", "INTEGER", "result_count"),
+    ("result_count_unique", "INTEGER", "result_count_unique"),
+    ("result_hash", "TEXT", "result_hash"),
+    ("result_hash_version", "INTEGER", "result_hash_version"),
+    ("requested_urls_count", "INTEGER", "requested_urls_count"),
+    ("requested_urls_count_unique", "INTEGER", "requested_urls_count_unique"),
+    ("fingerprint", "TEXT", "engine_fingerprint"),
+    ("schedule", "TEXT", "schedule"),
+    ("schedule_seed", "INTEGER", "schedule_seed"),
+)
+
+
+def get_index_row(path: Path, summary: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(
+        path.name if key == "path" else summary.get(key) for _, _, key in INDEX_COLUMNS
+    )
+
+
+def read_index_row(path: Path) -> Tuple[Any, ...] | None:
+    try:
+        result: Result = load_result(path, summary_only=True)
+        summary: Dict[str, Any] = result.summary
+        if summary.get("result_hash_version") != RESULT_HASH_VERSION:
+            # results saved with an earlier hash are hashed again from their data,
+            # so that they can still be compared to the newer ones
+            result = load_result(path)
+            summary = {
+                **summary,
+                "result_hash": result.get_result_hash(),
+                "result_hash_version": RESULT_HASH_VERSION,
+                "result_count_unique": result.get_result_count_unique(),
+            }
+        return get_index_row(path, summary)
+    except Exception as ex:
+        error(f"Failed to index {path}: {ex}")
+
+
+class ResultIndex:
+    """SQLite index with one row per execution in a results directory"""
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = path.joinpath(INDEX_NAME)
+        # the workers of the runner all add their results to the same index
+        self.lock: Lock = Lock()
+        self.connection: Connection = connect(self.path, check_same_thread=False)
+        self.connection.row_factory = Row
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS executions ("
+            + ", ".join(f"{name} {kind}" for name, kind, _ in INDEX_COLUMNS)
+            + ")"
+        )
+        # Indexes created before a column was added are migrated in place
+        existing: List[str] = list(
+            row["name"]
+            for row in self.connection.execute("PRAGMA table_info(executions)")
+        )
+        for name, kind, _ in INDEX_COLUMNS:
+            if name not in existing:
+                self.connection.execute(
+                    f"ALTER TABLE executions ADD COLUMN {name} {kind}"
+                )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS executions_query ON executions (query, config)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS executions_fingerprint "
+            "ON executions (fingerprint)"
+        )
+        # The executions of every query and config with the same fingerprint as the
+        # latest one, so that reports leave out executions with outdated inputs
+        self.connection.execute(
+            "CREATE VIEW IF NOT EXISTS current_executions AS "
+            "SELECT * FROM executions AS e WHERE e.fingerprint IS ("
+            "SELECT l.fingerprint FROM executions AS l "
+            "WHERE l.query = e.query AND l.config = e.config "
+            "ORDER BY l.path DESC LIMIT 1)"
+        )
+        self.connection.commit()
+
+    def add_rows(self, rows: Iterable[Tuple[Any, ...]]) -> None:
+        with self.lock:
+            self.connection.executemany(
+                # the columns are named, since migrated indexes have the columns
+                # added later at the end
+                f"INSERT OR REPLACE INTO executions "
+                f"({', '.join(name for name, _, _ in INDEX_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in INDEX_COLUMNS)})",
+                rows,
+            )
+            self.connection.commit()
+
+    def add_result(self, path: Path, result: Result) -> None:
+        self.add_rows((get_index_row(path, result.get_summary()),))
+
+    def select(self, sql: str, parameters: Tuple[Any, ...] = ()) -> List[Row]:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def rebuild_index(path: Path, processes: int | None = None) -> ResultIndex:
+    """Rebuild the index of a results directory, reading the summaries in parallel"""
+    # other JSON files, such as exported manifests, can be in the results directory
+    result_paths: List[Path] = sorted(
+        result_path
+        for result_path in path.glob("*.json")
+        if RESULT_NAME_PATTERN.fullmatch(result_path.stem)
+    )
+    info(f"Indexing {len(result_paths)} results in {path}")
+    index: ResultIndex = ResultIndex(path)
+    with index.lock:
+        index.connection.execute("DELETE FROM executions")
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        index.add_rows(
+            row
+            for row in executor.map(read_index_row, result_paths, chunksize=64)
+            if row
+        )
+    info(f"Finished indexing into {index.path}")
+    return index
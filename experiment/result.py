@@ -1,26 +1,108 @@
-from json import JSONDecodeError, loads, dumps
+from json import loads, dumps
+from gzip import open as gzip_open
+from array import array
 from datetime import datetime
-from logging import debug
 from pathlib import Path
-from typing import Dict, Any, List, TYPE_CHECKING
+from typing import Dict, Any, IO, Iterator, List, Tuple
 from hashlib import md5
+from math import ceil
+from re import Pattern, compile
 
-if TYPE_CHECKING:
-    from hashlib import _Hash
+import numpy as np
 
 TIME_FORMAT: str = "%Y-%m-%dT%H:%M:%SZ"
-TIME_FORMAT_FILENAME: str = "%Y%m%dT%H%M%SZ"
+TIME_FORMAT_FILENAME: str = "%Y%m%dT%H%M%S%fZ"
+
+# The names of saved results, with a suffix when several begin at the same time
+RESULT_NAME_PATTERN: Pattern = compile(r"\d{8}T\d{12}Z(-\d+)?")
+
+# Results are saved as a summary with the bulk data in a separate file by default
+RESULT_FORMATS: Tuple[str, ...] = ("compact", "json")
+
+# Fields recorded by the proxy for every request, with times in nanoseconds
+URL_TIMING_FIELDS: Tuple[str, ...] = (
+    "url",
+    "start",
+    "connect",
+    "first_byte",
+    "duration",
+    "status",
+    "bytes",
+    "content_type",
+)
+
+# Samples of the engine process, with the CPU times since the execution began
+SAMPLE_FIELDS: Tuple[str, ...] = (
+    "time",
+    "cpu_user_seconds",
+    "cpu_system_seconds",
+    "rss_bytes",
+    "rss_peak_bytes",
+    "threads",
+)
+
+
+# The result hash is the sum of the binding hashes, so that it does not depend on
+# the order of the bindings and can be updated as they arrive
+RESULT_HASH_MODULUS: int = 2**128
+
+# Version of the result hash, where 1 was the digest of the sorted bindings, and 2
+# is the sum of the digests of the individual bindings
+RESULT_HASH_VERSION: int = 2
+
+
+def serialize_binding(pairs: List[Tuple[str, str]]) -> str:
+    """Serialize sorted variables and terms the same way as json.dumps would"""
+    return (
+        "{" + ", ".join(f"{dumps(v, ensure_ascii=False)}: {t}" for v, t in pairs) + "}"
+    )
 
 
 class Result:
     def __init__(self, config: str, query: str) -> None:
         self.config: str = config
         self.query: str = query
-        self.results: Dict[int, Any] = {}
+        self.replication: int | None = None
+        self.replication_stop: str | None = None
+        self.fingerprint: str | None = None
+        self.schedule: str | None = None
+        self.schedule_seed: int | None = None
+        # Bindings are stored as arrays of variable and term identifiers, with the
+        # variables and terms interned, and the arrival times in nanoseconds
+        self.result_times: array = array("q")
+        self.result_offsets: array = array("q", (0,))
+        self.result_terms: array = array("q")
+        self.variables: Dict[str, int] = {}
+        self.variable_names: List[str] = []
+        self.terms: Dict[str, int] = {}
+        self.term_values: List[str] = []
+        self.result_hash: int = 0
+        # the unique bindings are only counted, so the digests are kept as 64-bit
+        # prefixes in an array rather than a set of digests
+        self.result_digests: array = array("Q")
+        # the unique count is cached with the number of digests it was counted from,
+        # since the summary is requested several times once the result is done
+        self.result_count_unique: Tuple[int, int] = (0, 0)
         self.other: Dict[int, str] = {}
         self.urls: List[str] = []
-        self.stderr: str | None = None
+        self.url_timings: List[Tuple[Any, ...]] = []
+        self.stderr: List[Tuple[int, str]] = []
+        self.stderr_dropped: int = 0
         self.timeout: bool = False
+        self.proxy_pool_hits: int = 0
+        self.proxy_pool_misses: int = 0
+        self.proxy_cache_hits: int = 0
+        self.proxy_cache_misses: int = 0
+        self.proxy_network: Dict[str, Any] | None = None
+        # The summary as stored on disk, when the result has been loaded from one
+        self.summary: Dict[str, Any] | None = None
+        self.engine_mode: str = "cold"
+        self.engine_startup_seconds: float | None = None
+        self.engine_output_format: str = "application/json"
+        self.engine_output_parse: str = "deferred"
+        self.engine_samples: List[Tuple[int, float, float, int, int, int]] = []
+        self.engine_peak_rss: int | None = None
+        self.engine_profiles: List[str] = []
 
     def begin(self) -> None:
         self.time_begin: datetime = datetime.utcnow()
@@ -28,87 +110,338 @@ class Result:
     def end(self) -> None:
         self.time_end: datetime = datetime.utcnow()
 
-    def add_result(self, timestamp: int, result: str) -> None:
-        try:
-            self.results[timestamp] = loads(result)
-        except JSONDecodeError as ex:
-            debug(ex)
-            self.other[timestamp] = (
-                result
-                if timestamp not in self.other
-                else self.other[timestamp] + result
+    def add_result(self, timestamp: int, result: Any) -> None:
+        if not isinstance(result, dict):
+            self.add_other(timestamp, dumps(result, ensure_ascii=False))
+            return
+        pairs: List[Tuple[str, str]] = sorted(
+            (variable, dumps(value, sort_keys=True, ensure_ascii=False))
+            for variable, value in result.items()
+        )
+        for variable, term in pairs:
+            if variable not in self.variables:
+                self.variables[variable] = len(self.variable_names)
+                self.variable_names.append(variable)
+            if term not in self.terms:
+                self.terms[term] = len(self.term_values)
+                self.term_values.append(term)
+            self.result_terms.append(self.variables[variable])
+            self.result_terms.append(self.terms[term])
+        self.result_offsets.append(len(self.result_terms))
+        self.result_times.append(timestamp)
+        digest: bytes = md5(
+            serialize_binding(pairs).encode(), usedforsecurity=False
+        ).digest()
+        self.result_hash = (
+            self.result_hash + int.from_bytes(digest, "big")
+        ) % RESULT_HASH_MODULUS
+        self.result_digests.append(int.from_bytes(digest[:8], "big"))
+
+    def get_result_count(self) -> int:
+        return len(self.result_times)
+
+    def get_result_string(self, index: int) -> str:
+        start: int = self.result_offsets[index]
+        end: int = self.result_offsets[index + 1]
+        return serialize_binding(
+            list(
+                (
+                    self.variable_names[self.result_terms[i]],
+                    self.term_values[self.result_terms[i + 1]],
+                )
+                for i in range(start, end, 2)
             )
+        )
 
-    def get_time_taken_seconds(self) -> float:
-        return (self.time_end - self.time_begin).total_seconds()
+    def get_results(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for index, timestamp in enumerate(self.result_times):
+            yield timestamp, loads(self.get_result_string(index))
 
-    def get_result_values_as_strings(self) -> List[str]:
-        result_values: List[str] = list(
-            dumps(r, sort_keys=True, ensure_ascii=False) for r in self.results.values()
+    def add_other(self, timestamp: int, other: str) -> None:
+        self.other[timestamp] = (
+            other if timestamp not in self.other else self.other[timestamp] + other
         )
-        result_values.sort()
-        return result_values
+
+    def get_time_taken_seconds(self) -> float:
+        return (self.time_end - self.time_begin).total_seconds()
 
     def get_result_hash(self) -> str:
-        return self.__result_hash__().hexdigest()
+        return f"{self.result_hash:032x}"
 
     def get_result_count_unique(self) -> int:
-        return len(set(self.get_result_values_as_strings()))
+        counted, count = self.result_count_unique
+        if counted != len(self.result_digests):
+            count = len(np.unique(np.frombuffer(self.result_digests, dtype=np.uint64)))
+            self.result_count_unique = (len(self.result_digests), count)
+        return count
 
     def get_url_count_unique(self) -> int:
         return len(set(self.urls))
 
-    def __result_hash__(self) -> "_Hash":
-        hash_object = md5(usedforsecurity=False)
-        for result in sorted(self.get_result_values_as_strings()):
-            hash_object.update(result.encode())
-        return hash_object
+    def get_url_bytes_total(self) -> int:
+        return sum(t[URL_TIMING_FIELDS.index("bytes")] for t in self.url_timings)
+
+    def get_url_error_count(self) -> int:
+        status_index: int = URL_TIMING_FIELDS.index("status")
+        return sum(1 for t in self.url_timings if t[status_index] >= 400)
+
+    def get_cpu_seconds(self, field: str) -> float | None:
+        """User or system CPU time of the engine from the last sample"""
+        if not self.engine_samples:
+            return None
+        return self.engine_samples[-1][SAMPLE_FIELDS.index(field)]
+
+    def get_cpu_utilisation(self) -> float | None:
+        """CPU time relative to the time taken, where one core fully used is 1"""
+        time_taken: float = self.get_time_taken_seconds()
+        if not self.engine_samples or time_taken <= 0:
+            return None
+        _, cpu_user, cpu_system, *_ = self.engine_samples[-1]
+        return round((cpu_user + cpu_system) / time_taken, 3)
+
+    def get_url_latency_seconds(self, percentile: float) -> float | None:
+        durations: List[int] = sorted(
+            t[URL_TIMING_FIELDS.index("duration")] for t in self.url_timings
+        )
+        if not durations:
+            return None
+        index: int = max(0, ceil(len(durations) * percentile / 100) - 1)
+        return durations[index] / 1e9
 
     def __eq__(self, __value: object) -> bool:
-        return isinstance(__value, self.__class__) and hash(self) == hash(__value)
+        return (
+            isinstance(__value, self.__class__)
+            and self.result_hash == __value.result_hash
+        )
 
     def __hash__(self) -> int:
-        return self.__result_hash__().digest()
+        return hash(self.result_hash)
 
-    def as_dict(self) -> Dict[str, Any]:
+    def get_summary(self) -> Dict[str, Any]:
         return {
             "time_begin": self.time_begin.strftime(TIME_FORMAT),
             "time_end": self.time_end.strftime(TIME_FORMAT),
             "time_taken_seconds": self.get_time_taken_seconds(),
+            "engine_cpu_user_seconds": self.get_cpu_seconds("cpu_user_seconds"),
+            "engine_cpu_system_seconds": self.get_cpu_seconds("cpu_system_seconds"),
+            "engine_cpu_utilisation": self.get_cpu_utilisation(),
+            "engine_peak_rss_bytes": self.engine_peak_rss,
             "engine_timeout_reached": self.timeout,
             "engine_config": self.config,
             "engine_query": self.query,
-            "engine_stderr": self.stderr,
+            "engine_fingerprint": self.fingerprint,
+            "replication": self.replication,
+            "replication_stop": self.replication_stop,
+            "schedule": self.schedule,
+            "schedule_seed": self.schedule_seed,
+            "engine_stderr_dropped": self.stderr_dropped,
+            "engine_mode": self.engine_mode,
+            "engine_startup_seconds": self.engine_startup_seconds,
+            "engine_output_format": self.engine_output_format,
+            "engine_output_parse": self.engine_output_parse,
+            "engine_profiles": self.engine_profiles,
             "result_hash": self.get_result_hash(),
-            "result_count": len(self.results),
+            "result_hash_version": RESULT_HASH_VERSION,
+            "result_count": self.get_result_count(),
             "result_count_unique": self.get_result_count_unique(),
-            "result_data": self.results,
-            "result_data_other": self.other,
-            "requested_urls": self.urls,
             "requested_urls_count": len(self.urls),
             "requested_urls_count_unique": self.get_url_count_unique(),
+            "requested_urls_bytes_total": self.get_url_bytes_total(),
+            "requested_urls_errors": self.get_url_error_count(),
+            "requested_urls_latency_p50_seconds": self.get_url_latency_seconds(50),
+            "requested_urls_latency_p95_seconds": self.get_url_latency_seconds(95),
+            "requested_urls_latency_max_seconds": self.get_url_latency_seconds(100),
+            "proxy_pool_hits": self.proxy_pool_hits,
+            "proxy_pool_misses": self.proxy_pool_misses,
+            "proxy_cache_hits": self.proxy_cache_hits,
+            "proxy_cache_misses": self.proxy_cache_misses,
+            "proxy_network": self.proxy_network,
         }
 
+    def get_bulk_records(self) -> Iterator[str]:
+        """Serialize the bindings, output and URLs as one JSON array per line"""
+        for index, timestamp in enumerate(self.result_times):
+            yield f'["result", {timestamp}, {self.get_result_string(index)}]'
+        for timestamp, other in self.other.items():
+            yield dumps(["other", int(timestamp), other], ensure_ascii=False)
+        for timestamp, line in self.stderr:
+            yield dumps(["stderr", timestamp, line], ensure_ascii=False)
+        for url in self.urls:
+            yield dumps(["url", url], ensure_ascii=False)
+        for url_timing in self.url_timings:
+            yield dumps(["url_timing", *url_timing], ensure_ascii=False)
+        for sample in self.engine_samples:
+            yield dumps(["sample", *sample])
+
+    def add_bulk_record(self, record: List[Any]) -> None:
+        record_type: str = record[0]
+        if record_type == "result":
+            self.add_result(record[1], record[2])
+        elif record_type == "other":
+            self.add_other(record[1], record[2])
+        elif record_type == "stderr":
+            self.stderr.append((record[1], record[2]))
+        elif record_type == "url":
+            self.urls.append(record[1])
+        elif record_type == "url_timing":
+            self.url_timings.append(tuple(record[1:]))
+        elif record_type == "sample":
+            self.engine_samples.append(tuple(record[1:]))
 
-def load_result(path: Path) -> Result:
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            **self.get_summary(),
+            "engine_stderr": "\n".join(line for _, line in self.stderr),
+            "result_data": list(list(r) for r in self.get_results()),
+            "result_data_other": self.other,
+            "result_data_stderr": self.stderr,
+            "requested_urls": self.urls,
+            "requested_urls_timings": {
+                field: list(t[i] for t in self.url_timings)
+                for i, field in enumerate(URL_TIMING_FIELDS)
+            },
+            "engine_samples": {
+                field: list(s[i] for s in self.engine_samples)
+                for i, field in enumerate(SAMPLE_FIELDS)
+            },
+        }
+
+
+def load_result(path: Path, summary_only: bool = False) -> Result:
     with open(path, "r") as result_file:
         data = loads(result_file.read())
     result: Result = Result(config=data["engine_config"], query=data["engine_query"])
+    result.summary = data
+    result.replication = data.get("replication")
+    result.replication_stop = data.get("replication_stop")
+    result.fingerprint = data.get("engine_fingerprint")
+    result.schedule = data.get("schedule")
+    result.schedule_seed = data.get("schedule_seed")
     result.timeout = data["engine_timeout_reached"]
     result.time_begin = datetime.strptime(data["time_begin"], TIME_FORMAT)
     result.time_end = datetime.strptime(data["time_end"], TIME_FORMAT)
-    result.urls = data["requested_urls"]
-    result.results = data["result_data"]
-    result.other = data["result_data_other"]
-    result.stderr = data["engine_stderr"]
+    result.stderr_dropped = data.get("engine_stderr_dropped", 0)
+    result.engine_mode = data.get("engine_mode", "cold")
+    result.engine_startup_seconds = data.get("engine_startup_seconds")
+    result.engine_output_format = data.get("engine_output_format", "application/json")
+    result.engine_output_parse = data.get("engine_output_parse", "deferred")
+    result.engine_peak_rss = data.get("engine_peak_rss_bytes")
+    result.engine_profiles = data.get("engine_profiles", [])
+    result.proxy_pool_hits = data.get("proxy_pool_hits", 0)
+    result.proxy_pool_misses = data.get("proxy_pool_misses", 0)
+    result.proxy_cache_hits = data.get("proxy_cache_hits", 0)
+    result.proxy_cache_misses = data.get("proxy_cache_misses", 0)
+    result.proxy_network = data.get("proxy_network")
+    if summary_only:
+        result.result_hash = int(data["result_hash"], 16)
+    elif "result_bulk" in data:
+        with gzip_open(path.parent.joinpath(data["result_bulk"]), "rt") as bulk_file:
+            for line in bulk_file:
+                result.add_bulk_record(loads(line))
+    else:
+        result.urls = data["requested_urls"]
+        url_timings: Dict[str, List[Any]] = data.get("requested_urls_timings", {})
+        if url_timings:
+            result.url_timings = list(
+                zip(*(url_timings[field] for field in URL_TIMING_FIELDS))
+            )
+        samples: Dict[str, List[Any]] = data.get("engine_samples", {})
+        if samples:
+            result.engine_samples = list(
+                zip(*(samples[field] for field in SAMPLE_FIELDS))
+            )
+        result_data: List[Tuple[int, Any]] | Dict[str, Any] = data["result_data"]
+        # results were previously stored by their arrival time
+        for timestamp, binding in (
+            result_data.items() if isinstance(result_data, dict) else result_data
+        ):
+            result.add_result(int(timestamp), binding)
+        result.other = data["result_data_other"]
+        result.stderr = list(
+            (timestamp, line)
+            for timestamp, line in data.get(
+                "result_data_stderr", [(0, data["engine_stderr"] or "")]
+            )
+            if line
+        )
     return result
 
 
-def save_result(path: Path, result: Result) -> Result:
-    result_path: Path = path.joinpath(
-        f"{result.time_begin.strftime(TIME_FORMAT_FILENAME)}.json"
-    )
-    with open(result_path, "w") as result_file:
-        result_file.write(
-            dumps(result.as_dict(), sort_keys=True, ensure_ascii=False, indent=2)
-        )
+def load_result_times(path: Path) -> Tuple[array, array]:
+    """Load only the arrival times of the results and other output of a result"""
+    with open(path, "r") as result_file:
+        data = loads(result_file.read())
+    if "result_bulk" not in data:
+        result: Result = load_result(path)
+        return result.result_times, array("q", (int(t) for t in result.other.keys()))
+    result_times: array = array("q")
+    other_times: array = array("q")
+    with gzip_open(path.parent.joinpath(data["result_bulk"]), "rt") as bulk_file:
+        for line in bulk_file:
+            # the records start with their type and timestamp, so the rest of the
+            # record does not need to be parsed
+            if line.startswith('["result", '):
+                result_times.append(int(line.split(", ", 2)[1]))
+            elif line.startswith('["other", '):
+                other_times.append(int(line.split(", ", 2)[1]))
+    return result_times, other_times
+
+
+def discard_partial_results(path: Path) -> List[Path]:
+    """Remove results that were left incomplete when an experiment was interrupted"""
+    discarded: List[Path] = []
+    # only the files named like results are considered, since the results can be
+    # written into a directory with other files, such as the engine package
+    for result_path in path.glob("*.json"):
+        if not RESULT_NAME_PATTERN.fullmatch(result_path.stem):
+            continue
+        try:
+            # the summary is written last, so the bulk data is complete when the
+            # summary can be read
+            with open(result_path, "r") as result_file:
+                loads(result_file.read())["engine_config"]
+            continue
+        except (ValueError, KeyError, TypeError):
+            result_path.unlink()
+            discarded.append(result_path)
+        bulk_path: Path = result_path.with_suffix(".jsonl.gz")
+        if bulk_path.exists():
+            bulk_path.unlink()
+            discarded.append(bulk_path)
+    for bulk_path in path.glob("*.jsonl.gz"):
+        summary_path: Path = bulk_path.with_suffix("").with_suffix(".json")
+        if (
+            RESULT_NAME_PATTERN.fullmatch(summary_path.stem)
+            and not summary_path.exists()
+        ):
+            bulk_path.unlink()
+            discarded.append(bulk_path)
+    return discarded
+
+
+def save_result(path: Path, result: Result, result_format: str = "compact") -> Path:
+    result_name: str = result.time_begin.strftime(TIME_FORMAT_FILENAME)
+    result_path: Path = path.joinpath(f"{result_name}.json")
+    suffix: int = 0
+    while True:
+        try:
+            # concurrent executions can begin within the same microsecond
+            result_file: IO[str] = open(result_path, "x")
+            break
+        except FileExistsError:
+            suffix += 1
+            result_path = path.joinpath(f"{result_name}-{suffix}.json")
+    with result_file:
+        if result_format == "json":
+            data: Dict[str, Any] = result.as_dict()
+        else:
+            # The bulk data is streamed into a separate compressed file, so that
+            # the summary can be read without it
+            bulk_path: Path = result_path.with_suffix(".jsonl.gz")
+            with gzip_open(bulk_path, "xt", encoding="utf-8", compresslevel=6) as bulk:
+                for record in result.get_bulk_records():
+                    bulk.write(record)
+                    bulk.write("\n")
+            data = {**result.get_summary(), "result_bulk": bulk_path.name}
+        result_file.write(dumps(data, sort_keys=True, ensure_ascii=False, indent=2))
+    return result_path
@@ -4,23 +4,130 @@ from logging import info, warn, error
 from typing import Dict, Any, List, Tuple
 from urllib.parse import urlparse, ParseResult
 from math import sqrt, ceil
-from matplotlib.cm import get_cmap
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
+from matplotlib import colormaps
 from matplotlib.axes import Axes
 from matplotlib.figure import Figure
-from matplotlib.pyplot import figure
+from matplotlib.pyplot import figure, close
 from matplotlib.colors import Colormap
 
+from experiment.index import ResultIndex
+from experiment.result import load_result_times
 
 # Time is recorded in nanoseconds
 TIME_DIVISOR: int = 1000 * 1000 * 1000
 IMAGE_EXTENSION: str = "svg"
 
+# Curves and output markers with more points than this are downsampled
+MAX_POINTS: int = 2000
+
+
+def downsample_lttb(
+    x: np.ndarray, y: np.ndarray, threshold: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Downsample a curve using Largest-Triangle-Three-Buckets, keeping its shape"""
+    length: int = len(x)
+    if threshold < 3 or length <= threshold:
+        return x, y
+    # the first and last points are always kept, and the others are split into
+    # buckets, from each of which the point forming the largest triangle is kept
+    edges: np.ndarray = np.linspace(1, length - 1, threshold - 1).astype(int)
+    selected: np.ndarray = np.zeros(threshold, dtype=int)
+    selected[-1] = length - 1
+    previous: int = 0
+    for i in range(0, threshold - 2):
+        start: int = edges[i]
+        end: int = edges[i + 1]
+        next_end: int = edges[i + 2] if i + 2 < len(edges) else length
+        next_x: float = x[end:next_end].mean()
+        next_y: float = y[end:next_end].mean()
+        areas: np.ndarray = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return x[selected], y[selected]
+
+
+def plot_other_times(
+    ax: Axes, other_times: List[float], plot_args: Dict[str, Any], max_points: int
+) -> None:
+    # Output times are drawn as a rug along the time axis in a single collection,
+    # binned when there are too many of them to draw individually
+    times: np.ndarray = np.asarray(other_times)
+    if len(times) > max_points:
+        counts, edges = np.histogram(times, bins=max_points)
+        times = ((edges[:-1] + edges[1:]) / 2)[counts > 0]
+    ax.vlines(
+        x=times, ymin=0, ymax=0.05, transform=ax.get_xaxis_transform(), **plot_args
+    )
+
+
+def plot_query(
+    ax: Axes,
+    query: str,
+    results: List["ChronomunicaResult"],
+    config_color: Dict[str, Tuple[float, float, float, float]],
+    max_points: int,
+) -> None:
+    ax.grid(axis="x", color="0.95", which="major")
+    ax.set_xlabel(xlabel="time (s)")
+    ax.set_ylabel("results")
+    ax.set_title(query)
+    query_max_time: float = 0.0
+    for result in sorted(results, key=lambda k: f"{k.query} {k.config}"):
+        query_max_time = max(query_max_time, result.max_time)
+        plot_args: Dict[str, Any] = {
+            "color": config_color[result.config],
+            "alpha": 0.8,
+            "lw": 1,
+        }
+        if result.result_count == 1:
+            ax.plot(
+                result.result_times[0],
+                1,
+                marker=".",
+                label=result.config,
+                **plot_args,
+            )
+        else:
+            x, y = downsample_lttb(
+                np.asarray(result.result_times),
+                np.arange(1, len(result.result_times) + 1),
+                max_points,
+            )
+            ax.step(x=x, y=y, where="post", label=result.config, **plot_args)
+        if result.other_times:
+            plot_other_times(ax, result.other_times, plot_args, max_points)
+    ax.set_xbound(lower=0, upper=int(ceil(query_max_time + 0.5)))
+
+
+def plot_query_file(
+    query: str,
+    results: List["ChronomunicaResult"],
+    config_color: Dict[str, Tuple[float, float, float, float]],
+    output_path: Path,
+    max_points: int,
+) -> Path:
+    fig: Figure = figure(dpi=300)
+    fig.set_size_inches(w=5, h=4)
+    ax: Axes = fig.add_subplot(1, 1, 1)
+    plot_query(ax, query, results, config_color, max_points)
+    ax.legend(loc="lower right")
+    fig.tight_layout(pad=1)
+    fig.savefig(fname=output_path, transparent=False, bbox_inches="tight")
+    close(fig)
+    return output_path
+
 
 class ChronomunicaResult:
     config: str
     query: str
     result_count: int
     result_hash: str
+    result_hash_version: int | None
     max_time: float
     result_times: List[float]
     other_times: List[float]
@@ -29,23 +136,34 @@ class ChronomunicaResult:
         self.config = self.config_uri_to_id(config)
         self.query = self.query_uri_to_id(query)
         self.result_hash = None
+        self.result_hash_version = None
         self.result_count = 0
         self.other_times = []
         self.result_times = []
         for rep in data:
             if not self.result_hash:
                 self.result_hash = rep["result_hash"]
+                self.result_hash_version = rep.get("result_hash_version")
                 self.result_count = int(rep["result_count"])
-            else:
+            elif self.result_hash_version == rep.get("result_hash_version"):
+                # hashes from different versions cannot be compared
                 assert (
                     self.result_hash == rep["result_hash"]
                 ), f"Inconsistent results for {self.query} with {self.config}"
-            if "other_output" in rep:
+            if "other_times" in rep:
+                other_times = list(t / TIME_DIVISOR for t in sorted(rep["other_times"]))
+                self.other_times = self.average_lists(self.other_times, other_times)
+            elif "other_output" in rep:
                 other_times = list(
                     int(k) / TIME_DIVISOR for k in rep["other_output"].keys()
                 )
                 self.other_times = self.average_lists(self.other_times, other_times)
-            if "result_bindings" in rep:
+            if "result_times" in rep:
+                result_times = list(
+                    t / TIME_DIVISOR for t in sorted(rep["result_times"])
+                )
+                self.result_times = self.average_lists(self.result_times, result_times)
+            elif "result_bindings" in rep:
                 result_times = list(
                     int(k) / TIME_DIVISOR for k in rep["result_bindings"].keys()
                 )
@@ -58,15 +176,17 @@ class ChronomunicaResult:
         )
 
     def average_lists(self, a: List[float], b: List[float]) -> List[float]:
+        # The merged trace is the running maximum of both traces, which is the
+        # same as comparing every value to the previous one, in linear time
         existing_length: int = min(len(a), len(b))
-        for i in range(0, existing_length):
-            new_value: float = b.pop(0)
-            prev_value: float = a[i - 1] if i > 0 else a[i]
-            a[i] = max(new_value, (a[i] + new_value) / 2, a[i], prev_value)
-        while len(b):
-            last_value: float = a[-1] if a else -1
-            a.append(max(b.pop(0), last_value))
-        return a
+        merged: np.ndarray = np.maximum(a[:existing_length], b[:existing_length])
+        if len(b) > len(a):
+            return np.maximum.accumulate(
+                np.concatenate((merged, b[existing_length:]))
+            ).tolist()
+        return np.concatenate(
+            (np.maximum.accumulate(merged), a[existing_length:])
+        ).tolist()
 
     def config_uri_to_id(self, uri: str) -> str:
         config_parsed: ParseResult = urlparse(uri)
@@ -97,8 +217,11 @@ class ChronomunicaResults:
 
     def __init__(self, path: Path) -> None:
         self.path = path
-        with open(path, "r") as result_file:
-            self.data = loads(result_file.read())
+        if path.is_dir():
+            self.data = self.load_index(path)
+        else:
+            with open(path, "r") as result_file:
+                self.data = loads(result_file.read())
         self.results = []
         for config, config_data in self.data.items():
             for query, query_data in config_data.items():
@@ -113,6 +236,28 @@ class ChronomunicaResults:
                 except Exception as ex:
                     error(ex)
 
+    def load_index(self, path: Path) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        # The index provides the executions and their hashes, so that only the
+        # arrival times need to be read from the result files
+        data: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        index: ResultIndex = ResultIndex(path)
+        for row in index.select(
+            "SELECT path, config, query, result_hash, result_hash_version, "
+            "result_count FROM current_executions WHERE NOT timeout ORDER BY path"
+        ):
+            result_times, other_times = load_result_times(path.joinpath(row["path"]))
+            data.setdefault(row["config"], {}).setdefault(row["query"], []).append(
+                {
+                    "result_hash": row["result_hash"],
+                    "result_hash_version": row["result_hash_version"],
+                    "result_count": row["result_count"],
+                    "result_times": result_times.tolist(),
+                    "other_times": other_times.tolist(),
+                }
+            )
+        index.close()
+        return data
+
     def make_diefficiency_y_axis(self, length: int) -> List[int]:
         return list(range(1, length + 1))
 
@@ -129,15 +274,13 @@ class ChronomunicaResults:
         plot_rows: int = ceil(subplots / plot_cols)
         return plot_rows, plot_cols
 
-    def plot_diefficiency(self, suffix: str = IMAGE_EXTENSION) -> None:
-        fig: Figure = figure(dpi=300)
-        output_path: Path = self.path.parent.joinpath(
-            f"{self.path.stem}-diefficiency.{suffix}"
-        )
-        subplot_index: int = 0
-        fig_handles = []
-        fig_labels = []
-        cmap: Colormap = get_cmap("tab10")
+    def plot_diefficiency(
+        self,
+        suffix: str = IMAGE_EXTENSION,
+        max_points: int = MAX_POINTS,
+        per_query: bool = False,
+    ) -> None:
+        cmap: Colormap = colormaps["tab10"]
         unique_configs: List[str] = list(sorted(set(r.config for r in self.results)))
         config_color: Dict[str, Tuple[float, float, float, float]] = {
             unique_configs[i]: cmap(i) for i in range(0, len(unique_configs))
@@ -147,44 +290,25 @@ class ChronomunicaResults:
             if result.query not in results_by_query:
                 results_by_query[result.query] = []
             results_by_query[result.query].append(result)
+        if per_query:
+            self.plot_diefficiency_per_query(
+                results_by_query, config_color, suffix, max_points
+            )
+            return
+        fig: Figure = figure(dpi=300)
+        output_path: Path = self.path.parent.joinpath(
+            f"{self.path.stem}-diefficiency.{suffix}"
+        )
+        subplot_index: int = 0
+        fig_handles = []
+        fig_labels = []
         rows, cols = self.calculate_rows_cols(len(results_by_query))
         info(f"Plotting into {cols} x {rows} grid")
         fig.set_size_inches(w=cols * 5, h=rows * 4)
         for query, results in results_by_query.items():
             subplot_index += 1
             ax: Axes = fig.add_subplot(rows, cols, subplot_index)
-            ax.grid(axis="x", color="0.95", which="major")
-            ax.set_xlabel(xlabel="time (s)")
-            ax.set_ylabel("results")
-            ax.set_title(query)
-            query_max_time: float = 0.0
-            for result in sorted(results, key=lambda k: f"{k.query} {k.config}"):
-                query_max_time = max(query_max_time, result.max_time)
-                plot_args: Dict[str, Any] = {
-                    "color": config_color[result.config],
-                    "alpha": 0.8,
-                    "lw": 1,
-                }
-                if result.result_count == 1:
-                    ax.plot(
-                        result.result_times[0],
-                        1,
-                        marker=".",
-                        label=result.config,
-                        **plot_args,
-                    )
-                else:
-                    ax.step(
-                        x=result.result_times,
-                        y=self.make_diefficiency_y_axis(result.result_count),
-                        where="post",
-                        label=result.config,
-                        **plot_args,
-                    )
-                if result.other_times:
-                    for t in result.other_times:
-                        ax.axvline(x=t, ls=":", **plot_args)
-            ax.set_xbound(lower=0, upper=int(ceil(query_max_time + 0.5)))
+            plot_query(ax, query, results, config_color, max_points)
             handles, labels = ax.get_legend_handles_labels()
             if len(handles) > len(fig_handles) and len(labels) > len(fig_labels):
                 fig_labels = labels
@@ -199,11 +323,39 @@ class ChronomunicaResults:
         fig.tight_layout(pad=1, h_pad=1, w_pad=1)
         fig.savefig(fname=output_path, transparent=False, bbox_inches="tight")
 
+    def plot_diefficiency_per_query(
+        self,
+        results_by_query: Dict[str, List[ChronomunicaResult]],
+        config_color: Dict[str, Tuple[float, float, float, float]],
+        suffix: str,
+        max_points: int,
+    ) -> None:
+        info(f"Plotting {len(results_by_query)} queries into separate files")
+        with ProcessPoolExecutor() as executor:
+            futures: List[Future] = list(
+                executor.submit(
+                    plot_query_file,
+                    query,
+                    results,
+                    config_color,
+                    self.path.parent.joinpath(
+                        f"{self.path.stem}-{query.replace(' ', '-')}"
+                        f"-diefficiency.{suffix}"
+                    ),
+                    max_points,
+                )
+                for query, results in results_by_query.items()
+            )
+            for future in futures:
+                info(f"Plotted {future.result()}")
+
 
-def plot_chronomunica_results(path: Path) -> None:
+def plot_chronomunica_results(
+    path: Path, max_points: int = MAX_POINTS, per_query: bool = False
+) -> None:
     info(f"Visualizing results from {path}")
     results: ChronomunicaResults = ChronomunicaResults(path)
-    results.plot_diefficiency()
+    results.plot_diefficiency(max_points=max_points, per_query=per_query)
     info("Finished visualization")
 
 
@@ -211,11 +363,15 @@ def plot_jbr_results(path: Path) -> None:
     pass
 
 
-def plot_results(path: Path) -> None:
+def plot_results(
+    path: Path, max_points: int = MAX_POINTS, per_query: bool = False
+) -> None:
     match path.suffix:
         case ".csv":
             plot_jbr_results(path)
         case ".json":
-            plot_chronomunica_results(path)
+            plot_chronomunica_results(path, max_points, per_query)
+        case "" if path.is_dir():
+            plot_chronomunica_results(path, max_points, per_query)
         case _:
             info(f"Unknown result type {path}")
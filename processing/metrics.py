@@ -0,0 +1,146 @@
+from csv import writer
+from pathlib import Path
+from argparse import ArgumentParser
+from logging import basicConfig, info, INFO
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from experiment.index import ResultIndex
+from experiment.result import load_result_times
+
+# Time is recorded in nanoseconds
+TIME_DIVISOR: int = 1000 * 1000 * 1000
+
+METRICS: Tuple[str, ...] = (
+    "result_count",
+    "time_to_first_result",
+    "time_to_last_result",
+    "throughput",
+    "dief@t",
+    "dief@k",
+    "timeout",
+)
+
+
+class Trace:
+    """The answer trace of one execution, as arrival times in seconds"""
+
+    def __init__(self, path: Path, time_taken: float, timeout: bool) -> None:
+        result_times, _ = load_result_times(path)
+        self.times: np.ndarray = np.sort(
+            np.frombuffer(result_times, dtype=np.int64) / TIME_DIVISOR
+        )
+        self.time_taken: float = time_taken
+        self.timeout: bool = timeout
+
+
+def trapezoid(x: np.ndarray, y: np.ndarray) -> float:
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2)) if len(x) > 1 else 0.0
+
+
+def dief_at_t(times: np.ndarray, t: float) -> float:
+    """Area under the answer trace until time t, where higher is better"""
+    count: int = int(np.searchsorted(times, t, side="right"))
+    x: np.ndarray = np.append(times[:count], t)
+    y: np.ndarray = np.append(np.arange(1, count + 1), count)
+    return trapezoid(x, y)
+
+
+def dief_at_k(times: np.ndarray, k: int) -> float:
+    """Area under the answer trace until the k-th answer, where lower is better"""
+    if k < 1 or len(times) < k:
+        return np.nan
+    return trapezoid(times[:k], np.arange(1, k + 1))
+
+
+def calculate_metrics(
+    traces: List[Trace], t: float, k: int
+) -> Dict[str, Tuple[float, float]]:
+    values: Dict[str, np.ndarray] = {
+        "result_count": np.array(list(len(r.times) for r in traces), dtype=float),
+        "time_to_first_result": np.array(
+            list(r.times[0] if len(r.times) else np.nan for r in traces)
+        ),
+        "time_to_last_result": np.array(
+            list(r.times[-1] if len(r.times) else np.nan for r in traces)
+        ),
+        "throughput": np.array(
+            list(
+                len(r.times) / r.time_taken if r.time_taken > 0 else np.nan
+                for r in traces
+            )
+        ),
+        "dief@t": np.array(list(dief_at_t(r.times, t) for r in traces)),
+        "dief@k": np.array(list(dief_at_k(r.times, k) for r in traces)),
+        "timeout": np.array(list(r.timeout for r in traces), dtype=float),
+    }
+    return {
+        metric: (
+            (float(np.nanmean(v)), float(np.nanstd(v)))
+            if np.any(~np.isnan(v))
+            else (np.nan, np.nan)
+        )
+        for metric, v in values.items()
+    }
+
+
+def load_traces(path: Path) -> Dict[str, Dict[str, List[Trace]]]:
+    traces: Dict[str, Dict[str, List[Trace]]] = {}
+    index: ResultIndex = ResultIndex(path)
+    for row in index.select(
+        "SELECT path, config, query, time_taken_seconds, timeout "
+        "FROM current_executions ORDER BY path"
+    ):
+        traces.setdefault(row["query"], {}).setdefault(row["config"], []).append(
+            Trace(
+                path.joinpath(row["path"]),
+                row["time_taken_seconds"],
+                bool(row["timeout"]),
+            )
+        )
+    index.close()
+    return traces
+
+
+def write_metrics(
+    path: Path, output: Path, t: float | None = None, k: int | None = None
+) -> None:
+    info(f"Calculating metrics for {path}")
+    traces: Dict[str, Dict[str, List[Trace]]] = load_traces(path)
+    with open(output, "w", newline="") as output_file:
+        csv = writer(output_file)
+        csv.writerow(("query", "config", "replications", "metric", "mean", "std"))
+        for query, query_traces in sorted(traces.items()):
+            all_traces: List[Trace] = list(
+                r for config_traces in query_traces.values() for r in config_traces
+            )
+            # By default, the configs of a query are compared until the last answer
+            # of the slowest one, and until the answer count of the least complete
+            query_t: float = t or max(
+                (float(r.times[-1]) for r in all_traces if len(r.times)), default=0.0
+            )
+            query_k: int = k or min(
+                (len(r.times) for r in all_traces if len(r.times)), default=0
+            )
+            for config, config_traces in sorted(query_traces.items()):
+                metrics: Dict[str, Tuple[float, float]] = calculate_metrics(
+                    config_traces, query_t, query_k
+                )
+                for metric in METRICS:
+                    mean, std = metrics[metric]
+                    csv.writerow((query, config, len(config_traces), metric, mean, std))
+    info(f"Wrote metrics into {output}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Calculate diefficiency and other metrics from results"
+    )
+    parser.add_argument("results", type=Path, help="Path to the results directory")
+    parser.add_argument("--output", type=Path, default=Path("metrics.csv"))
+    parser.add_argument("--t", type=float, help="Time in seconds for dief@t")
+    parser.add_argument("--k", type=int, help="Answer count for dief@k")
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+    write_metrics(path=args.results.resolve(), output=args.output, t=args.t, k=args.k)
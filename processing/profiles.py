@@ -0,0 +1,120 @@
+from csv import writer
+from json import loads
+from pathlib import Path
+from argparse import ArgumentParser
+from logging import basicConfig, info, warning, INFO
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from experiment.index import ResultIndex
+from experiment.result import Result, load_result
+
+# Functions are identified by their name and location in the source
+Function = Tuple[str, str, int]
+
+
+def read_self_times(path: Path) -> Dict[Function, float]:
+    """Self time of every function in a V8 CPU profile, in milliseconds"""
+    with open(path, "r") as profile_file:
+        profile = loads(profile_file.read())
+    functions: List[Function] = list(
+        (
+            node["callFrame"]["functionName"] or "(anonymous)",
+            node["callFrame"]["url"],
+            node["callFrame"]["lineNumber"] + 1,
+        )
+        for node in profile["nodes"]
+    )
+    node_ids: np.ndarray = np.array(list(n["id"] for n in profile["nodes"]))
+    samples: np.ndarray = np.array(profile.get("samples", []), dtype=np.int64)
+    if not len(samples):
+        return {}
+    # The time delta before each sample is the time until the following one, so
+    # the time spent in a sample is the delta of the next sample
+    deltas: np.ndarray = np.append(
+        np.array(profile["timeDeltas"], dtype=np.float64)[1:], 0
+    )
+    order: np.ndarray = np.argsort(node_ids)
+    nodes: np.ndarray = order[np.searchsorted(node_ids, samples, sorter=order)]
+    self_times: np.ndarray = np.bincount(
+        nodes, weights=deltas, minlength=len(functions)
+    )
+    totals: Dict[Function, float] = {}
+    for function, self_time in zip(functions, self_times):
+        if self_time > 0:
+            totals[function] = totals.get(function, 0) + self_time / 1000
+    return totals
+
+
+def find_profiles(path: Path, query: str, config: Path) -> List[Path]:
+    index: ResultIndex = ResultIndex(path)
+    profiles: List[Path] = []
+    for row in index.select(
+        "SELECT path FROM executions WHERE query = ? AND config = ? ORDER BY path",
+        (query, config.as_uri()),
+    ):
+        result: Result = load_result(path.joinpath(row["path"]), summary_only=True)
+        profiles.extend(
+            path.joinpath(p)
+            for p in result.summary.get("engine_profiles", [])
+            if p.endswith(".cpuprofile")
+        )
+    index.close()
+    return profiles
+
+
+def write_top_functions(
+    path: Path, query: str, config: Path, output: Path, top: int = 20
+) -> None:
+    profiles: List[Path] = find_profiles(path, query, config)
+    if not profiles:
+        warning(f"No CPU profiles found for <{query}> <{config.as_uri()}>")
+        return
+    info(f"Aggregating {len(profiles)} CPU profiles")
+    totals: Dict[Function, float] = {}
+    counts: Dict[Function, int] = {}
+    for profile in profiles:
+        for function, self_time in read_self_times(profile).items():
+            totals[function] = totals.get(function, 0) + self_time
+            counts[function] = counts.get(function, 0) + 1
+    total: float = sum(totals.values())
+    with open(output, "w", newline="") as output_file:
+        csv = writer(output_file)
+        csv.writerow(
+            ("function", "url", "line", "profiles", "self_ms", "self_share", "mean_ms")
+        )
+        for function, self_time in sorted(totals.items(), key=lambda f: -f[1])[:top]:
+            name, url, line = function
+            csv.writerow(
+                (
+                    name,
+                    url,
+                    line,
+                    counts[function],
+                    round(self_time, 3),
+                    round(self_time / total, 4),
+                    round(self_time / len(profiles), 3),
+                )
+            )
+    info(f"Wrote top {top} functions into {output}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Aggregate the top self-time functions from engine CPU profiles"
+    )
+    parser.add_argument("results", type=Path, help="Path to the results directory")
+    parser.add_argument("--query", required=True, help="Query identifier")
+    parser.add_argument("--config", required=True, type=Path, help="Config path")
+    parser.add_argument("--output", type=Path, default=Path("profile.csv"))
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+    write_top_functions(
+        path=args.results.resolve(),
+        query=args.query,
+        config=args.config.resolve(),
+        output=args.output,
+        top=args.top,
+    )
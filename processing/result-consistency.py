@@ -1,26 +1,34 @@
 from typing import Dict, List
 from pathlib import Path
-from json import loads
 from sys import argv
 
+from experiment.index import ResultIndex
+
 
 def check_result_consistency(results: Path) -> None:
     expected_hash: Dict[str, str] = {}
+    expected_version: Dict[str, int | None] = {}
     expected_count: Dict[str, int] = {}
     received_count: Dict[str, List[int]] = {}
     print(f"Checking consistency in {results}")
-    for result_path in results.iterdir():
-        with open(result_path, "r") as result_file:
-            data = loads(result_file.read())
-        if data["engine_timeout_reached"] is True:
-            continue
-        config: str = data["engine_config"]
-        query: str = data["engine_query"]
-        result_hash: str = data["result_hash"]
-        result_count: int = data["result_count"]
+    # The index is maintained by the runner, and can be rebuilt using --index
+    index: ResultIndex = ResultIndex(results)
+    rows = index.select(
+        "SELECT config, query, result_hash, result_hash_version, result_count "
+        "FROM current_executions WHERE NOT timeout ORDER BY path"
+    )
+    index.close()
+    for config, query, result_hash, result_hash_version, result_count in rows:
         if query not in expected_hash:
             expected_hash[query] = result_hash
+            expected_version[query] = result_hash_version
             expected_count[query] = result_count
+        elif expected_version[query] != result_hash_version:
+            # hashes from different versions never match, even for the same results
+            print(f"Different result hash versions for <{query}>:")
+            print(f"\tconfig: {config}")
+            print(f"\tversions: {result_hash_version} / {expected_version[query]}")
+            print("\tthe index can be rebuilt using --index to hash them again")
         elif expected_hash[query] != result_hash:
             print(f"Different results for <{query}>:")
             print(f"\tconfig: {config}")
@@ -0,0 +1,470 @@
+from io import BytesIO
+from time import monotonic_ns
+from socket import socket, create_server, IPPROTO_TCP, TCP_NODELAY
+from logging import info, debug, error, exception
+from typing import AsyncIterator, Dict, List, Set, Tuple
+from threading import Thread
+from http import HTTPStatus
+from asyncio import (
+    AbstractEventLoop,
+    IncompleteReadError,
+    Server,
+    StreamReader,
+    StreamWriter,
+    new_event_loop,
+    sleep,
+    run_coroutine_threadsafe,
+    start_server,
+    to_thread,
+)
+
+from runner.connectionpool import AsyncConnectionPool
+from runner.rewriter import StreamRewriter
+from runner.httpcache import CachedResponse, HttpCache
+from runner.network import NetworkProfile, Throttle
+from runner.proxyserver import BaseProxyServer, ProxyRequest, ProxySession, CHUNK_SIZE
+
+# The proxy only needs to handle the same methods as the threaded server
+PROXY_METHODS: Set[str] = set(("GET", "HEAD", "OPTIONS"))
+
+
+def get_reason(status: int, reason: str = "") -> str:
+    # status codes outside of the standard ones keep the reason of the upstream
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return reason
+
+
+class UpstreamResponse:
+    def __init__(
+        self,
+        reader: StreamReader,
+        writer: StreamWriter,
+        method: str,
+        status: int,
+        reason: str,
+        headers: List[Tuple[str, str]],
+    ) -> None:
+        self.reader: StreamReader = reader
+        self.writer: StreamWriter = writer
+        self.status: int = status
+        self.reason: str = reason
+        self.headers: List[Tuple[str, str]] = headers
+        header_values: Dict[str, str] = {k.lower(): v for k, v in headers}
+        self.has_body: bool = method != "HEAD" and status not in (
+            HTTPStatus.NO_CONTENT,
+            HTTPStatus.NOT_MODIFIED,
+        )
+        self.chunked: bool = (
+            "chunked" in header_values.get("transfer-encoding", "").lower()
+        )
+        self.length: int | None = (
+            int(header_values["content-length"])
+            if "content-length" in header_values and not self.chunked
+            else None
+        )
+        # without framing, the body ends when the upstream closes the connection
+        self.will_close: bool = self.has_body and not self.chunked
+        self.will_close = self.will_close and self.length is None
+        self.will_close = self.will_close or (
+            header_values.get("connection", "").lower() == "close"
+        )
+        self.complete: bool = not self.has_body
+
+    async def read_body(self) -> AsyncIterator[bytes]:
+        if self.complete:
+            return
+        if self.chunked:
+            while True:
+                size: int = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # the trailer section ends with an empty line
+                    while (await self.reader.readline()).strip():
+                        pass
+                    break
+                yield await self.reader.readexactly(size)
+                await self.reader.readexactly(2)
+        elif self.length is not None:
+            remaining: int = self.length
+            while remaining > 0:
+                data: bytes = await self.reader.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    raise IncompleteReadError(partial=b"", expected=remaining)
+                remaining -= len(data)
+                yield data
+        else:
+            while data := await self.reader.read(CHUNK_SIZE):
+                yield data
+        self.complete = True
+
+
+class AsyncProxyServer(BaseProxyServer):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        upstream_host: str,
+        upstream_port: int,
+        pool_size: int = 16,
+        pool_idle_timeout: float = 30,
+        cache: HttpCache | None = None,
+        network: NetworkProfile | None = None,
+    ) -> None:
+        super().__init__(
+            host=host,
+            upstream_host=upstream_host,
+            upstream_port=upstream_port,
+            cache=cache,
+            network=network,
+        )
+        self.upstream_host: str = f"{upstream_host}:{upstream_port}"
+        self.pool: AsyncConnectionPool = AsyncConnectionPool(
+            host=upstream_host,
+            port=upstream_port,
+            size=pool_size,
+            idle_timeout=pool_idle_timeout,
+        )
+        # The listening socket is bound first, so that port 0 can be used to let
+        # the operating system pick a free port
+        self.socket: socket = create_server((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.clients: Set[StreamWriter] = set()
+        # bandwidth is limited per connection from the engine
+        self.throttles: Dict[StreamWriter, Throttle] = {}
+        self.server: Server | None = None
+        self.loop: AbstractEventLoop = new_event_loop()
+        self.thread: Thread = Thread(target=self.loop.run_forever, daemon=True)
+        info(f"Proxy server: <{self.get_listen_base()}> to <{self.proxy_base}>")
+
+    def start(self) -> None:
+        self.thread.start()
+        self.server = run_coroutine_threadsafe(
+            start_server(self.handle_client, sock=self.socket), self.loop
+        ).result()
+        info("Started proxy server")
+
+    def stop(self) -> None:
+        run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        info(f"Connection pool hits {self.pool.hits} misses {self.pool.misses}")
+        info("Stopped proxy server")
+
+    async def shutdown(self) -> None:
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        self.pool.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self.clients.add(writer)
+        # the response is written in parts, which would otherwise be delayed by the
+        # Nagle algorithm
+        writer.get_extra_info("socket").setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        throttle: Throttle | None = (
+            self.network.get_throttle() if self.network else None
+        )
+        if throttle:
+            self.throttles[writer] = throttle
+        try:
+            keep_alive: bool = True
+            while keep_alive:
+                try:
+                    head: bytes = await reader.readuntil(b"\r\n\r\n")
+                except (IncompleteReadError, ConnectionError):
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, version = request_line.split(" ", 2)
+                headers: List[Tuple[str, str]] = list(
+                    (k.strip(), v.strip())
+                    for k, _, v in (line.partition(":") for line in header_lines)
+                    if k
+                )
+                keep_alive = await self.proxy_request(method, target, headers, writer)
+                keep_alive = keep_alive and version == "HTTP/1.1"
+                keep_alive = keep_alive and not any(
+                    k.lower() == "connection" and v.lower() == "close"
+                    for k, v in headers
+                )
+        except Exception as ex:
+            exception(ex)
+        finally:
+            self.clients.discard(writer)
+            self.throttles.pop(writer, None)
+            writer.close()
+
+    async def request_upstream(
+        self,
+        session: ProxySession,
+        request: ProxyRequest,
+        method: str,
+        path: str,
+        headers: Dict[str, str],
+    ) -> UpstreamResponse:
+        time_acquire: int = monotonic_ns()
+        reader, writer, reused = await self.pool.acquire()
+        if not reused:
+            request.connect = monotonic_ns() - time_acquire
+        session.add_pool_use(reused)
+        request_head: str = "".join(
+            (
+                f"{method} {path} HTTP/1.1\r\n",
+                f"Host: {self.upstream_host}\r\n",
+                *(f"{k}: {v}\r\n" for k, v in headers.items()),
+                "\r\n",
+            )
+        )
+        try:
+            writer.write(request_head.encode("latin-1"))
+            await writer.drain()
+            head: bytes = await reader.readuntil(b"\r\n\r\n")
+        except (ConnectionError, IncompleteReadError) as ex:
+            writer.close()
+            if not reused:
+                raise ConnectionResetError(ex)
+            # a pooled connection may have been closed by the upstream while idle
+            debug(f"Retrying with a new connection after failure on {path}")
+            return await self.request_upstream(session, request, method, path, headers)
+        request.set_first_byte()
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        _, status, *reason = status_line.split(" ", 2)
+        return UpstreamResponse(
+            reader=reader,
+            writer=writer,
+            method=method,
+            status=int(status),
+            reason="".join(reason),
+            headers=list(
+                (k.strip(), v.strip())
+                for k, _, v in (line.partition(":") for line in header_lines)
+                if k
+            ),
+        )
+
+    async def release_upstream(self, response: UpstreamResponse) -> None:
+        # the response is only complete, and the connection reusable, once the rest
+        # of the body has been consumed
+        async for _ in response.read_body():
+            pass
+        if response.will_close:
+            response.writer.close()
+        else:
+            self.pool.release(response.reader, response.writer)
+
+    async def send_error(
+        self,
+        writer: StreamWriter,
+        code: int,
+        request: ProxyRequest | None = None,
+        reason: str = "",
+    ) -> bool:
+        if request:
+            request.status = code
+        phrase: str = get_reason(code, reason)
+        body: bytes = (f"<html><body><h1>{code} {phrase}</h1></body></html>").encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {code} {phrase}\r\n"
+                "Content-Type: text/html;charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
+        return False
+
+    async def send_head(
+        self,
+        writer: StreamWriter,
+        request: ProxyRequest,
+        method: str,
+        status: int,
+        headers: List[Tuple[str, str]],
+        client_base: str,
+        reason: str = "",
+    ) -> bool:
+        request.status = status
+        client_headers: List[Tuple[str, str]] = self.get_client_headers(
+            headers, client_base
+        )
+        request.content_type = next(
+            (v for k, v in client_headers if k.lower() == "content-type"), None
+        )
+        has_body: bool = method != "HEAD" and status not in (
+            HTTPStatus.NO_CONTENT,
+            HTTPStatus.NOT_MODIFIED,
+        )
+        response_head: str = "".join(
+            (
+                f"HTTP/1.1 {status} {get_reason(status, reason)}\r\n",
+                *(f"{k}: {v}\r\n" for k, v in client_headers),
+                "Transfer-Encoding: chunked\r\n\r\n" if has_body else "\r\n",
+            )
+        )
+        writer.write(response_head.encode("latin-1"))
+        return has_body
+
+    async def relay_body(
+        self,
+        writer: StreamWriter,
+        request: ProxyRequest,
+        chunks: AsyncIterator[bytes],
+        rewriter: StreamRewriter,
+        recording: bytearray | None = None,
+    ) -> None:
+        async for chunk in chunks:
+            if recording is not None:
+                recording.extend(chunk)
+            data: bytes = rewriter.feed(chunk)
+            if data:
+                await self.write_chunk(writer, request, data)
+        data = rewriter.flush()
+        if data:
+            await self.write_chunk(writer, request, data)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def write_chunk(
+        self, writer: StreamWriter, request: ProxyRequest, data: bytes
+    ) -> None:
+        throttle: Throttle | None = self.throttles.get(writer)
+        if throttle:
+            await sleep(throttle.get_wait(len(data)))
+        writer.write(b"%X\r\n%s\r\n" % (len(data), data))
+        request.size += len(data)
+        await writer.drain()
+
+    async def replay_response(
+        self,
+        writer: StreamWriter,
+        request: ProxyRequest,
+        method: str,
+        cached: CachedResponse,
+        client_base: str,
+    ) -> bool:
+        if cached.status >= 400:
+            return await self.send_error(writer, cached.status, request)
+        if await self.send_head(
+            writer, request, method, cached.status, cached.headers, client_base
+        ):
+            body: BytesIO = BytesIO(cached.body)
+
+            async def read_cached() -> AsyncIterator[bytes]:
+                while data := body.read(CHUNK_SIZE):
+                    yield data
+
+            await self.relay_body(
+                writer,
+                request,
+                read_cached(),
+                StreamRewriter(self.proxy_base.encode(), client_base.encode()),
+            )
+        else:
+            await writer.drain()
+        return True
+
+    async def proxy_request(
+        self,
+        method: str,
+        target: str,
+        headers: List[Tuple[str, str]],
+        writer: StreamWriter,
+    ) -> bool:
+        debug(f"Proxy {method: <7} {target}")
+        if method not in PROXY_METHODS:
+            return await self.send_error(writer, HTTPStatus.NOT_IMPLEMENTED.value)
+        response: UpstreamResponse | None = None
+        session, path = self.get_session(target)
+        client_base: str = f"{self.get_listen_base()}{session.base}"
+        request: ProxyRequest = ProxyRequest(session, f"{self.proxy_base}{path}")
+        try:
+            if self.network:
+                await sleep(
+                    self.network.get_delay(
+                        f"{self.proxy_base}{path}", session.replication
+                    )
+                )
+            recording: bytearray | None = None
+            if self.cache:
+                cache_key: str = self.cache.get_key(
+                    method,
+                    path,
+                    next((v for k, v in headers if k.lower() == "accept"), None),
+                )
+                cached: CachedResponse | None = await to_thread(
+                    self.cache.get, cache_key
+                )
+                request.set_first_byte()
+                session.add_cache_use(cached is not None)
+                if cached:
+                    return await self.replay_response(
+                        writer, request, method, cached, client_base
+                    )
+                elif self.cache.mode == "replay":
+                    error(f"No recorded response for {self.proxy_base}{path}")
+                    return await self.send_error(
+                        writer, HTTPStatus.BAD_GATEWAY.value, request
+                    )
+                recording = bytearray()
+            response = await self.request_upstream(
+                session, request, method, path, self.get_upstream_headers(headers)
+            )
+            keep_alive: bool = True
+            if response.status >= 400:
+                error(f"{response.status} {self.proxy_base}{path}")
+                keep_alive = await self.send_error(
+                    writer, response.status, request, response.reason
+                )
+            elif await self.send_head(
+                writer,
+                request,
+                method,
+                response.status,
+                response.headers,
+                client_base,
+                response.reason,
+            ):
+                await self.relay_body(
+                    writer,
+                    request,
+                    response.read_body(),
+                    StreamRewriter(self.proxy_base.encode(), client_base.encode()),
+                    recording,
+                )
+            else:
+                await writer.drain()
+            await self.release_upstream(response)
+            # only complete responses without an error are recorded, so that a
+            # transient upstream failure is not replayed in every later run
+            if (
+                self.cache
+                and recording is not None
+                and response.complete
+                and response.status < 400
+            ):
+                await to_thread(
+                    self.cache.put,
+                    cache_key,
+                    CachedResponse(
+                        status=response.status,
+                        headers=response.headers,
+                        body=bytes(recording),
+                    ),
+                )
+            return keep_alive
+        except ConnectionError as ex:
+            error(ex)
+            return await self.send_error(writer, HTTPStatus.BAD_GATEWAY.value, request)
+        except Exception as ex:
+            exception(ex)
+            return await self.send_error(
+                writer, HTTPStatus.INTERNAL_SERVER_ERROR.value, request
+            )
+        finally:
+            if response and not response.complete:
+                response.writer.close()
+            session.add_request(request)
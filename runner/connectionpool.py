@@ -0,0 +1,88 @@
+from time import monotonic
+from logging import debug
+from threading import Lock
+from typing import List, Tuple
+from http.client import HTTPConnection
+from asyncio import StreamReader, StreamWriter, open_connection
+
+
+class ConnectionPool:
+    def __init__(self, host: str, port: int, size: int, idle_timeout: float) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.size: int = size
+        self.idle_timeout: float = idle_timeout
+        self.idle: List[Tuple[HTTPConnection, float]] = []
+        self.lock: Lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def acquire(self) -> Tuple[HTTPConnection, bool]:
+        expired: List[HTTPConnection] = []
+        connection: HTTPConnection | None = None
+        with self.lock:
+            while self.idle:
+                idle_connection, idle_since = self.idle.pop()
+                if monotonic() - idle_since < self.idle_timeout:
+                    connection = idle_connection
+                    break
+                expired.append(idle_connection)
+            if connection:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for idle_connection in expired:
+            idle_connection.close()
+        if connection:
+            return connection, True
+        return HTTPConnection(host=self.host, port=self.port), False
+
+    def release(self, connection: HTTPConnection) -> None:
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((connection, monotonic()))
+                return
+        debug(f"Connection pool full, closing connection to {self.host}:{self.port}")
+        connection.close()
+
+    def close(self) -> None:
+        with self.lock:
+            idle: List[Tuple[HTTPConnection, float]] = self.idle
+            self.idle = []
+        for connection, _ in idle:
+            connection.close()
+
+
+class AsyncConnectionPool:
+    def __init__(self, host: str, port: int, size: int, idle_timeout: float) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.size: int = size
+        self.idle_timeout: float = idle_timeout
+        self.idle: List[Tuple[StreamReader, StreamWriter, float]] = []
+        self.hits: int = 0
+        self.misses: int = 0
+
+    async def acquire(self) -> Tuple[StreamReader, StreamWriter, bool]:
+        # the pool is only used from the event loop thread, so it needs no lock
+        while self.idle:
+            reader, writer, idle_since = self.idle.pop()
+            if monotonic() - idle_since < self.idle_timeout and not reader.at_eof():
+                self.hits += 1
+                return reader, writer, True
+            writer.close()
+        self.misses += 1
+        reader, writer = await open_connection(host=self.host, port=self.port)
+        return reader, writer, False
+
+    def release(self, reader: StreamReader, writer: StreamWriter) -> None:
+        if len(self.idle) < self.size:
+            self.idle.append((reader, writer, monotonic()))
+        else:
+            debug(f"Connection pool full, closing connection to {self.host}")
+            writer.close()
+
+    def close(self) -> None:
+        for _, writer, _ in self.idle:
+            writer.close()
+        self.idle.clear()
@@ -0,0 +1,75 @@
+'use strict';
+
+// Long-running query engine process for the warm execution mode. The engine is
+// created once from the package given as the first argument and the config in
+// COMUNICA_CONFIG, after which queries are read from stdin as JSON lines with the
+// query string and context. The bindings of each query are written to stdout in
+// the same format as the command line interface, one JSON object per line.
+
+const { resolve } = require('node:path');
+const { createInterface } = require('node:readline');
+
+const XSD_STRING = 'http://www.w3.org/2001/XMLSchema#string';
+
+function termToString(term) {
+  switch (term.termType) {
+    case 'NamedNode':
+      return term.value;
+    case 'BlankNode':
+      return `_:${term.value}`;
+    case 'Variable':
+      return `?${term.value}`;
+    case 'Literal':
+      if (term.language) {
+        return `"${term.value}"@${term.language}`;
+      }
+      if (term.datatype && term.datatype.value !== XSD_STRING) {
+        return `"${term.value}"^^${term.datatype.value}`;
+      }
+      return `"${term.value}"`;
+    case 'Quad':
+      return `<<${termToString(term.subject)} ${termToString(term.predicate)} ${termToString(term.object)}>>`;
+    default:
+      return term.value;
+  }
+}
+
+function writeBindings(bindingsStream) {
+  return new Promise((resolve, reject) => {
+    bindingsStream.on('data', (bindings) => {
+      const result = {};
+      for (const [ variable, term ] of bindings) {
+        result[variable.value] = termToString(term);
+      }
+      process.stdout.write(`${JSON.stringify(result)},\n`);
+    });
+    bindingsStream.on('error', reject);
+    bindingsStream.on('end', resolve);
+  });
+}
+
+async function main() {
+  const { QueryEngineFactory } = require(resolve(process.argv[2]));
+  const engine = await new QueryEngineFactory().create({ configPath: process.env.COMUNICA_CONFIG });
+  process.stdout.write('ready\n');
+  for await (const line of createInterface({ input: process.stdin, crlfDelay: Infinity })) {
+    if (!line.trim()) {
+      continue;
+    }
+    const request = JSON.parse(line);
+    // Documents fetched by earlier queries should not make later ones faster
+    await engine.invalidateHttpCache();
+    process.stdout.write('[\n');
+    try {
+      await writeBindings(await engine.queryBindings(request.query, request.context));
+    } catch (error) {
+      process.stderr.write(`${error.stack || error}\n`);
+    }
+    process.stdout.write(']\n');
+  }
+}
+
+main().catch((error) => {
+  process.stderr.write(`${error.stack || error}\n`);
+  process.exit(1);
+});
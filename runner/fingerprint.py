@@ -0,0 +1,83 @@
+from json import dumps
+from hashlib import sha256
+from pathlib import Path
+from logging import warning
+from subprocess import run
+from typing import Any, Dict
+
+from experiment.experiment import Experiment
+
+
+def hash_file(path: Path | None) -> str | None:
+    if not path or not path.is_file():
+        return None
+    with open(path, "rb") as input_file:
+        return sha256(input_file.read()).hexdigest()
+
+
+def get_node_version(node: Path) -> str | None:
+    try:
+        return (
+            run(args=[node.as_posix(), "--version"], capture_output=True, timeout=10)
+            .stdout.decode(errors="replace")
+            .strip()
+        )
+    except Exception as ex:
+        warning(f"Failed to get the version of {node}: {ex}")
+
+
+class ExecutionFingerprints:
+    """Hashes of everything that affects the outcome of an execution"""
+
+    def __init__(self, experiment: Experiment, parse: str) -> None:
+        # The installed engine version is recorded in the package file of the
+        # engine, while the binary itself rarely changes
+        self.engine: Dict[str, Any] = {
+            "bin": hash_file(experiment.query_engine_bin),
+            "package": hash_file(experiment.query_engine_cwd.joinpath("package.json")),
+            "node": get_node_version(experiment.query_engine_node),
+            "worker": hash_file(experiment.query_engine_worker),
+            "mode": experiment.query_engine_mode,
+            "output_format": experiment.query_engine_output_format,
+            "context": experiment.query_engine_context,
+            "environment": experiment.query_engine_environment,
+        }
+        # The settings of the harness that affect the measurements are included, so
+        # that changing the proxy or the timeout does not reuse earlier executions
+        self.measurement: Dict[str, Any] = {
+            "timeout": experiment.query_engine_timeout,
+            "parse": parse,
+            "proxy_implementation": experiment.proxy_server_implementation,
+            "proxy_pool_size": experiment.proxy_server_pool_size,
+            "proxy_pool_idle_timeout": experiment.proxy_server_pool_idle_timeout,
+            "proxy_cache_mode": experiment.proxy_server_cache_mode,
+            "proxy_cache_path": (
+                experiment.proxy_server_cache_path.as_posix()
+                if experiment.proxy_server_cache_mode != "passthrough"
+                else None
+            ),
+            "proxy_network": experiment.proxy_server_network,
+        }
+        self.queries: Dict[str, str] = {
+            query_id: sha256(query_string.encode()).hexdigest()
+            for query_id, query_string in experiment.query_strings.items()
+        }
+        self.configs: Dict[Path, str | None] = {
+            config_path: hash_file(config_path) for config_path in experiment.configs
+        }
+
+    def get(self, query_id: str, config_path: Path) -> str:
+        return sha256(
+            dumps(
+                {
+                    # the identifiers are included, since reports group by them
+                    "query_id": query_id,
+                    "query": self.queries[query_id],
+                    "config_path": config_path.as_posix(),
+                    "config": self.configs[config_path],
+                    **self.engine,
+                    **self.measurement,
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
@@ -0,0 +1,93 @@
+from json import dumps, loads
+from pathlib import Path
+from hashlib import sha256
+from logging import info
+from threading import Lock, get_ident
+from collections import OrderedDict
+from typing import List, Tuple
+
+CACHE_MODES: Tuple[str, ...] = ("passthrough", "record", "replay")
+
+
+class CachedResponse:
+    def __init__(self, status: int, headers: List[Tuple[str, str]], body: bytes):
+        self.status: int = status
+        self.headers: List[Tuple[str, str]] = headers
+        self.body: bytes = body
+
+
+class HttpCache:
+    def __init__(self, path: Path, mode: str, memory_size: int) -> None:
+        if mode not in CACHE_MODES:
+            raise Exception(
+                f'Unknown cache mode "{mode}", expected one of {", ".join(CACHE_MODES)}'
+            )
+        self.path: Path = path
+        self.mode: str = mode
+        self.memory_size: int = memory_size
+        self.memory_used: int = 0
+        self.memory: OrderedDict[str, CachedResponse] = OrderedDict()
+        self.lock: Lock = Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+        info(f"HTTP cache in {mode} mode at <{path.as_uri()}>")
+
+    def get_key(self, method: str, path: str, accept: str | None) -> str:
+        return sha256(f"{method} {path} {accept or ''}".encode()).hexdigest()
+
+    def get_entry_path(self, key: str) -> Path:
+        return self.path.joinpath(key[:2], key)
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self.lock:
+            response: CachedResponse | None = self.memory.get(key)
+            if response:
+                self.memory.move_to_end(key)
+                return response
+        entry_path: Path = self.get_entry_path(key)
+        try:
+            metadata = loads(entry_path.with_suffix(".json").read_text())
+            body: bytes = entry_path.with_suffix(".body").read_bytes()
+        except FileNotFoundError:
+            return None
+        if metadata["status"] >= 400 and self.mode == "record":
+            # error responses recorded by earlier versions are requested again
+            return None
+        response = CachedResponse(
+            status=metadata["status"],
+            headers=list((k, v) for k, v in metadata["headers"]),
+            body=body,
+        )
+        self.remember(key, response)
+        return response
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        entry_path: Path = self.get_entry_path(key)
+        entry_path.parent.mkdir(exist_ok=True)
+        # the body is written before the metadata, which marks the entry complete,
+        # and both are renamed into place so concurrent readers never see partial data
+        for suffix, data in (
+            (".body", response.body),
+            (
+                ".json",
+                dumps(
+                    {"status": response.status, "headers": response.headers}
+                ).encode(),
+            ),
+        ):
+            temporary_path: Path = entry_path.with_suffix(f"{suffix}.{get_ident()}.tmp")
+            temporary_path.write_bytes(data)
+            temporary_path.replace(entry_path.with_suffix(suffix))
+        self.remember(key, response)
+
+    def remember(self, key: str, response: CachedResponse) -> None:
+        if len(response.body) > self.memory_size:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_used -= len(self.memory.pop(key).body)
+            self.memory[key] = response
+            self.memory_used += len(response.body)
+            # entries dropped from memory remain available on disk
+            while self.memory_used > self.memory_size:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_used -= len(evicted.body)
@@ -0,0 +1,80 @@
+from os import fsync
+from json import dumps, loads, JSONDecodeError
+from pathlib import Path
+from logging import info, warning
+from threading import Lock
+from typing import IO, Dict, Tuple
+
+JOURNAL_NAME: str = "journal.jsonl"
+
+
+class ExperimentJournal:
+    """Append-only record of the executions that have been saved"""
+
+    def __init__(self, path: Path, resume: bool) -> None:
+        self.path: Path = path.joinpath(JOURNAL_NAME)
+        self.lock: Lock = Lock()
+        # the completed executions are mapped to the names of their results
+        self.completed: Dict[Tuple[str, str, int], str] = (
+            self.load() if resume and self.path.exists() else {}
+        )
+        self.resume: bool = resume
+        self.file: IO[str] | None = None
+
+    def open_file(self) -> IO[str]:
+        if not self.resume and self.path.exists() and self.path.stat().st_size > 0:
+            # The journal of an interrupted experiment is only moved aside once the
+            # new experiment saves a result, so that it is not lost to a run that
+            # was started without --resume by accident
+            suffix: int = 1
+            while self.path.with_name(f"{self.path.stem}-{suffix}.jsonl").exists():
+                suffix += 1
+            rotated: Path = self.path.with_name(f"{self.path.stem}-{suffix}.jsonl")
+            self.path.rename(rotated)
+            warning(f"Moved the journal of the previous experiment to {rotated}")
+        journal: IO[str] = open(self.path, "a")
+        if journal.tell() > 0:
+            with open(self.path, "rb") as journal_file:
+                journal_file.seek(-1, 2)
+                if journal_file.read(1) != b"\n":
+                    journal.write("\n")
+        return journal
+
+    def load(self) -> Dict[Tuple[str, str, int], str]:
+        completed: Dict[Tuple[str, str, int], str] = {}
+        with open(self.path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = loads(line)
+                    completed[
+                        (entry["query"], entry["config"], entry["replication"])
+                    ] = entry["result"]
+                except (JSONDecodeError, KeyError):
+                    # the last line can be cut short by a crash
+                    warning(f"Ignoring invalid journal entry {line.strip()}")
+        info(f"Loaded {len(completed)} completed executions from {self.path}")
+        return completed
+
+    def is_completed(self, query: str, config: Path, replication: int) -> bool:
+        return (query, config.as_posix(), replication) in self.completed
+
+    def add(self, query: str, config: Path, replication: int, result: Path) -> None:
+        entry: str = dumps(
+            {
+                "query": query,
+                "config": config.as_posix(),
+                "replication": replication,
+                "result": result.name,
+            },
+            ensure_ascii=False,
+        )
+        with self.lock:
+            if not self.file:
+                self.file = self.open_file()
+            self.file.write(f"{entry}\n")
+            self.file.flush()
+            fsync(self.file.fileno())
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
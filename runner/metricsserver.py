@@ -0,0 +1,71 @@
+from json import dumps
+from logging import info, debug
+from threading import Thread
+from typing import Any, Callable, Dict, Tuple
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The reported metrics, with their Prometheus type and description
+METRICS: Tuple[Tuple[str, str, str], ...] = (
+    ("executions_done_total", "counter", "Executions finished in this run"),
+    ("executions_remaining", "gauge", "Executions not yet finished in this run"),
+    ("executions_timeout_total", "counter", "Executions that reached the timeout"),
+    ("eta_seconds", "gauge", "Expected remaining time from the observed durations"),
+    ("eta_maximum_seconds", "gauge", "Remaining time if every execution times out"),
+    ("proxy_requests_total", "counter", "Requests received by the proxy"),
+    ("proxy_requests_per_second", "gauge", "Proxy requests per second, last minute"),
+    ("proxy_requests_in_flight", "gauge", "Proxy requests not yet finished"),
+    ("proxy_errors_total", "counter", "Proxy responses with an error status"),
+    ("engine_rss_bytes", "gauge", "Current RSS of the running engines"),
+)
+
+METRICS_PREFIX: str = "chronomunica"
+
+
+class MetricsServer:
+    """Serves the metrics of a running experiment as Prometheus text or JSON"""
+
+    def __init__(
+        self, host: str, port: int, collect: Callable[[], Dict[str, Any]]
+    ) -> None:
+        class MetricsHTTPRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                metrics: Dict[str, Any] = collect()
+                if self.path == "/metrics.json":
+                    body: bytes = dumps(metrics).encode()
+                    content_type: str = "application/json"
+                elif self.path == "/metrics":
+                    body = "".join(
+                        f"# HELP {METRICS_PREFIX}_{name} {description}\n"
+                        f"# TYPE {METRICS_PREFIX}_{name} {kind}\n"
+                        f"{METRICS_PREFIX}_{name} {metrics[name]}\n"
+                        for name, kind, description in METRICS
+                    ).encode()
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(HTTPStatus.NOT_FOUND)
+                    return
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                debug(f"Metrics {format % args}")
+
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
+            (host, port), MetricsHTTPRequestHandler
+        )
+        self.server.daemon_threads = True
+        self.thread: Thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        info(f"Metrics server: <http://{host}:{port}/metrics>")
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
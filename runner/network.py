@@ -0,0 +1,71 @@
+from time import monotonic
+from random import Random
+from typing import Any, Dict, Tuple
+
+JITTER_DISTRIBUTIONS: Tuple[str, ...] = ("none", "uniform", "normal", "exponential")
+
+
+class Throttle:
+    def __init__(self, bandwidth: int) -> None:
+        self.bandwidth: int = bandwidth
+        self.time_available: float = monotonic()
+
+    def get_wait(self, size: int) -> float:
+        # the data is sent once the previous data has been transmitted, and the
+        # caller waits until this data would have been transmitted as well
+        time_now: float = monotonic()
+        self.time_available = max(time_now, self.time_available) + size / self.bandwidth
+        return self.time_available - time_now
+
+
+class NetworkProfile:
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        jitter_distribution: str = "none",
+        bandwidth: int = 0,
+        seed: int = 0,
+    ) -> None:
+        if jitter_distribution not in JITTER_DISTRIBUTIONS:
+            raise Exception(
+                f'Unknown jitter distribution "{jitter_distribution}", '
+                f'expected one of {", ".join(JITTER_DISTRIBUTIONS)}'
+            )
+        if latency < 0 or jitter < 0 or bandwidth < 0:
+            raise Exception(
+                f"Invalid network profile with latency {latency}, jitter {jitter} "
+                f"and bandwidth {bandwidth}, which cannot be negative"
+            )
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.jitter_distribution: str = jitter_distribution
+        self.bandwidth: int = bandwidth
+        self.seed: int = seed
+
+    def get_delay(self, url: str, replication: int = 0) -> float:
+        if self.jitter <= 0 or self.jitter_distribution == "none":
+            return self.latency
+        # seeding by URL keeps the delays independent of the order of the requests,
+        # and by replication so that the replications do not see the same delays
+        random: Random = Random(f"{self.seed} {replication} {url}")
+        match self.jitter_distribution:
+            case "uniform":
+                jitter = random.uniform(-self.jitter, self.jitter)
+            case "normal":
+                jitter = random.gauss(0, self.jitter)
+            case "exponential":
+                jitter = random.expovariate(1 / self.jitter)
+        return max(0, self.latency + jitter)
+
+    def get_throttle(self) -> Throttle | None:
+        return Throttle(self.bandwidth) if self.bandwidth > 0 else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "jitter_distribution": self.jitter_distribution,
+            "bandwidth": self.bandwidth,
+            "seed": self.seed,
+        }
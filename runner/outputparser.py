@@ -0,0 +1,167 @@
+from json import JSONDecodeError, dumps, loads
+from typing import Any, Dict, Iterator, List, Type
+from re import Pattern, Match, compile
+
+# Parsing can happen while reading the engine output, or after the engine is done
+PARSE_MODES = ("deferred", "inline")
+
+RESULT_PATTERN: Pattern = compile(r"(?P<result>{.*})")
+NTRIPLES_TERM_PATTERN: Pattern = compile(
+    r'(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^<[^>]*>)?)'
+)
+
+XSD_STRING: str = "http://www.w3.org/2001/XMLSchema#string"
+
+
+def ntriples_to_string(term: str) -> str:
+    """Convert an N-Triples term into the string form used by the engine CLI"""
+    if term.startswith("<") and term.endswith(">"):
+        return term[1:-1]
+    if term.startswith('"') and term.endswith(">") and '"^^<' in term:
+        value, datatype = term.rsplit("^^", 1)
+        return f"{value}^^{datatype[1:-1]}"
+    return term
+
+
+def sparql_json_to_string(term: Dict[str, Any]) -> str:
+    """Convert a SPARQL JSON results term into the string form used by the engine CLI"""
+    term_type: str | None = term.get("type")
+    if term_type == "uri":
+        return term["value"]
+    elif term_type == "bnode":
+        return f"_:{term['value']}"
+    elif term_type in ("literal", "typed-literal"):
+        if "xml:lang" in term:
+            return f"\"{term['value']}\"@{term['xml:lang']}"
+        elif term.get("datatype", XSD_STRING) != XSD_STRING:
+            return f"\"{term['value']}\"^^{term['datatype']}"
+        return f"\"{term['value']}\""
+    return str(term.get("value"))
+
+
+class OutputParser:
+    """Parser for the output of the engine, fed one line at a time"""
+
+    # The line ending that marks the end of the results, if the format has one
+    terminator: bytes | None = None
+
+    def parse(self, line: str) -> Iterator[Dict[str, Any] | str]:
+        """Yield the bindings parsed from a line, and any unrecognised output as-is"""
+        line = line.strip()
+        if line:
+            yield line
+
+    def flush(self) -> Iterator[str]:
+        """Yield any output left incomplete when the engine stopped"""
+        yield from ()
+
+
+class JsonParser(OutputParser):
+    """The default output of the engine, with one JSON object per binding"""
+
+    terminator: bytes | None = b"]"
+
+    def __init__(self) -> None:
+        self.pending: str = ""
+
+    def parse(self, line: str) -> Iterator[Dict[str, Any] | str]:
+        text: str = line.strip()
+        if self.pending:
+            text = f"{self.pending}\n{text}"
+            self.pending = ""
+        record: str = text.removeprefix("[").removesuffix(",").strip()
+        if not record or record == "]":
+            return
+        try:
+            yield from self.convert(loads(record))
+            return
+        except JSONDecodeError:
+            if record.startswith("{") and record.count("{") > record.count("}"):
+                # pretty-printed objects span multiple lines
+                self.pending = text
+                return
+        record_match: Match[str] | None = RESULT_PATTERN.match(record)
+        if record_match:
+            try:
+                yield from self.convert(loads(record_match.group("result")))
+                record = record.replace(record_match.group("result"), "").strip()
+            except JSONDecodeError:
+                pass
+        if record:
+            yield record
+
+    def convert(self, value: Any) -> Iterator[Dict[str, Any] | str]:
+        yield value
+
+    def flush(self) -> Iterator[str]:
+        if self.pending:
+            yield self.pending
+            self.pending = ""
+
+
+class SparqlJsonParser(JsonParser):
+    """SPARQL 1.1 Query Results JSON, with the bindings on their own lines"""
+
+    terminator: bytes | None = b"]}}"
+
+    def parse(self, line: str) -> Iterator[Dict[str, Any] | str]:
+        # the document itself is left open around the bindings
+        if not self.pending and line.lstrip().startswith(('{"head"', '"results"')):
+            return
+        yield from super().parse(line)
+
+    def convert(self, value: Any) -> Iterator[Dict[str, Any] | str]:
+        if isinstance(value, dict):
+            yield {k: sparql_json_to_string(v) for k, v in value.items()}
+        else:
+            yield dumps(value)
+
+
+class TsvParser(OutputParser):
+    """SPARQL 1.1 Query Results TSV, with the variables on the first line"""
+
+    def __init__(self) -> None:
+        self.variables: List[str] | None = None
+
+    def parse(self, line: str) -> Iterator[Dict[str, Any] | str]:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            return
+        if self.variables is None:
+            self.variables = list(v.strip().removeprefix("?") for v in line.split("\t"))
+            return
+        values: List[str] = line.split("\t")
+        if len(values) != len(self.variables):
+            yield line
+            return
+        yield {
+            variable: ntriples_to_string(value)
+            for variable, value in zip(self.variables, values)
+            if value
+        }
+
+
+class NTriplesParser(OutputParser):
+    """N-Triples, as produced for CONSTRUCT and DESCRIBE queries"""
+
+    def parse(self, line: str) -> Iterator[Dict[str, Any] | str]:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+        terms: List[str] = NTRIPLES_TERM_PATTERN.findall(line)
+        if len(terms) != 3 or not line.endswith("."):
+            yield line
+            return
+        yield {
+            "subject": ntriples_to_string(terms[0]),
+            "predicate": ntriples_to_string(terms[1]),
+            "object": ntriples_to_string(terms[2]),
+        }
+
+
+OUTPUT_PARSERS: Dict[str, Type[OutputParser]] = {
+    "application/json": JsonParser,
+    "application/sparql-results+json": SparqlJsonParser,
+    "text/tab-separated-values": TsvParser,
+    "application/n-triples": NTriplesParser,
+}
@@ -0,0 +1,54 @@
+from pathlib import Path
+from random import Random
+from tempfile import mkdtemp
+from typing import Any, Dict, List
+
+# Node writes the profiles into the directory when the process exits normally
+PROFILE_FLAGS: List[str] = [
+    "--cpu-prof",
+    "--cpu-prof-dir={directory}",
+    "--heap-prof",
+    "--heap-prof-dir={directory}",
+]
+
+
+class EngineProfiler:
+    """Selects executions to run with the Node profiler and collects the profiles"""
+
+    def __init__(self, path: Path, options: Dict[str, Any]) -> None:
+        self.path: Path = path.joinpath("profiles")
+        self.flags: List[str] = options.get("flags") or PROFILE_FLAGS
+        self.queries: List[str] = options.get("queries", [])
+        self.configs: List[Path] = list(
+            Path(p).resolve() for p in options.get("configs", [])
+        )
+        self.fraction: float = options.get("fraction", 0)
+        self.seed: int = options.get("seed", 0)
+
+    def is_selected(self, query_id: str, config_path: Path, replication: int) -> bool:
+        if query_id in self.queries or config_path in self.configs:
+            return True
+        # the sampled executions are seeded by the execution, so that the same
+        # ones are selected again when the experiment is resumed
+        random: Random = Random(
+            f"{self.seed} {query_id} {config_path.as_posix()} {replication}"
+        )
+        return random.random() < self.fraction
+
+    def create_directory(self) -> Path:
+        self.path.mkdir(parents=True, exist_ok=True)
+        return Path(mkdtemp(dir=self.path))
+
+    def get_args(self, directory: Path) -> List[str]:
+        return list(flag.format(directory=directory.as_posix()) for flag in self.flags)
+
+    def collect(self, directory: Path) -> List[str]:
+        """Paths of the profiles relative to the results directory"""
+        profiles: List[str] = sorted(
+            p.relative_to(self.path.parent).as_posix()
+            for p in directory.iterdir()
+            if p.is_file()
+        )
+        if not profiles:
+            directory.rmdir()
+        return profiles
@@ -1,12 +1,17 @@
-from logging import info, debug, error, exception
-from typing import Any, List, Set
-from threading import Thread
+from abc import ABC, abstractmethod
+from time import monotonic_ns, sleep
+from logging import info, debug, error, exception, warning
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from threading import Lock, Thread
+from io import BytesIO
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from http.client import HTTPResponse
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
+from http.client import HTTPConnection, HTTPResponse
 
+from runner.connectionpool import ConnectionPool
+from runner.rewriter import StreamRewriter
+from runner.httpcache import CachedResponse, HttpCache
+from runner.network import NetworkProfile, Throttle
 
 IGNORE_HEADERS: Set[str] = set(
     (
@@ -14,75 +19,441 @@ IGNORE_HEADERS: Set[str] = set(
         "content-length",
         "transfer-encoding",
         "connection",
+        "keep-alive",
+        "accept-encoding",
     )
 )
 
+# Upstream response bodies are relayed to the engine in chunks of at most this size
+CHUNK_SIZE: int = 64 * 1024
 
-class ProxyServer:
+# Pending connection backlog for the listening socket of the proxy
+LISTEN_BACKLOG: int = 128
+
+# Requests with a path starting with this prefix and a session identifier are
+# attributed to that session, with the prefix removed before proxying
+SESSION_PATH: str = "/.chronomunica"
+
+
+class ProxySession:
+    def __init__(self, base: str, replication: int = 0) -> None:
+        self.base: str = base
+        self.replication: int = replication
+        self.time_start: int = monotonic_ns()
+        self.urls: List[str] = []
+        self.requests: List[Tuple[int, int, int, int, int, int, int, str | None]] = []
+        self.pool_hits: int = 0
+        self.pool_misses: int = 0
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+        self.lock: Lock = Lock()
+
+    def add_pool_use(self, reused: bool) -> None:
+        with self.lock:
+            if reused:
+                self.pool_hits += 1
+            else:
+                self.pool_misses += 1
+
+    def add_url(self, url: str) -> int:
+        with self.lock:
+            self.urls.append(url)
+            return len(self.urls) - 1
+
+    def add_request(self, request: "ProxyRequest") -> None:
+        time_end: int = monotonic_ns()
+        with self.lock:
+            self.requests.append(
+                (
+                    request.index,
+                    request.time_start - self.time_start,
+                    request.connect,
+                    request.ttfb,
+                    time_end - request.time_start,
+                    request.status,
+                    request.size,
+                    request.content_type,
+                )
+            )
+
+    def add_cache_use(self, hit: bool) -> None:
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+
+def get_error_count(session: ProxySession) -> int:
+    return sum(1 for r in list(session.requests) if r[5] >= 400)
+
+
+class ProxyRequest:
+    def __init__(self, session: ProxySession, url: str) -> None:
+        self.time_start: int = monotonic_ns()
+        self.index: int = session.add_url(url)
+        self.connect: int = 0
+        self.ttfb: int = 0
+        self.status: int = 0
+        self.size: int = 0
+        self.content_type: str | None = None
+
+    def set_first_byte(self) -> None:
+        self.ttfb = monotonic_ns() - self.time_start
+
+
+class BaseProxyServer(ABC):
+    def __init__(
+        self,
+        host: str,
+        upstream_host: str,
+        upstream_port: int,
+        cache: HttpCache | None,
+        network: NetworkProfile | None,
+    ) -> None:
+        self.host: str = host
+        self.port: int = 0
+        self.proxy_base: str = f"http://{upstream_host}:{upstream_port}"
+        self.sessions: Dict[str, ProxySession] = {}
+        self.sessions_lock: Lock = Lock()
+        self.sessions_opened: int = 0
+        # Totals of the closed sessions, so that the live counts only need to go
+        # through the open sessions and the request path is not affected
+        self.sessions_requests: int = 0
+        self.sessions_errors: int = 0
+        # Requests outside of a session path that could not be attributed to the
+        # single open session are only counted
+        self.unattributed_requests: int = 0
+        self.unattributed_warned: bool = False
+        self.cache: HttpCache | None = cache
+        self.network: NetworkProfile | None = network
+
+    @abstractmethod
+    def start(self) -> None:
+        pass
+
+    @abstractmethod
+    def stop(self) -> None:
+        pass
+
+    def open_session(self, replication: int = 0) -> str:
+        with self.sessions_lock:
+            self.sessions_opened += 1
+            session: str = str(self.sessions_opened)
+            self.sessions[session] = ProxySession(
+                base=f"{SESSION_PATH}/{session}", replication=replication
+            )
+        return session
+
+    def close_session(self, session: str) -> ProxySession:
+        with self.sessions_lock:
+            proxy_session: ProxySession = self.sessions.pop(session)
+            self.sessions_requests += len(proxy_session.urls)
+            self.sessions_errors += get_error_count(proxy_session)
+            return proxy_session
+
+    def get_request_counts(self) -> Tuple[int, int, int]:
+        """Number of requests, requests in flight and error responses so far"""
+        with self.sessions_lock:
+            sessions: List[ProxySession] = list(self.sessions.values())
+            requests: int = self.sessions_requests + self.unattributed_requests
+            errors: int = self.sessions_errors
+        in_flight: int = 0
+        for proxy_session in sessions:
+            started: int = len(proxy_session.urls)
+            requests += started
+            in_flight += max(started - len(proxy_session.requests), 0)
+            errors += get_error_count(proxy_session)
+        return requests, in_flight, errors
+
+    def get_listen_base(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def get_session_base(self, session: str) -> str:
+        return f"{self.get_listen_base()}{SESSION_PATH}/{session}"
+
+    def get_session(self, path: str) -> Tuple[ProxySession, str]:
+        if path.startswith(f"{SESSION_PATH}/"):
+            session, _, session_path = path.removeprefix(f"{SESSION_PATH}/").partition(
+                "/"
+            )
+            with self.sessions_lock:
+                proxy_session: ProxySession | None = self.sessions.get(session)
+            if not proxy_session:
+                # requests arriving after the session was closed are not recorded
+                proxy_session = ProxySession(base=f"{SESSION_PATH}/{session}")
+            return proxy_session, f"/{session_path}"
+        # Root-relative references in the documents resolve outside of the session
+        # path, and can only belong to the execution of the single open session
+        with self.sessions_lock:
+            if len(self.sessions) == 1:
+                return next(iter(self.sessions.values())), path
+            self.unattributed_requests += 1
+            sessions_open: int = len(self.sessions)
+            warn: bool = sessions_open > 0 and not self.unattributed_warned
+            self.unattributed_warned = self.unattributed_warned or warn
+        if warn:
+            warning(
+                f"Request for {path} outside of a session while {sessions_open} "
+                "sessions are open cannot be attributed to an execution"
+            )
+        return ProxySession(base=""), path
+
+    def get_upstream_headers(
+        self, headers: Iterable[Tuple[str, str]]
+    ) -> Dict[str, str]:
+        upstream_headers: Dict[str, str] = {
+            k: v
+            for k, v in headers
+            if k.lower() != "host" and k.lower() not in IGNORE_HEADERS
+        }
+        # the body is rewritten as-is, so it cannot be compressed
+        upstream_headers["Accept-Encoding"] = "identity"
+        return upstream_headers
+
+    def get_client_headers(
+        self, headers: Iterable[Tuple[str, str]], client_base: str
+    ) -> List[Tuple[str, str]]:
+        return list(
+            (
+                k,
+                (
+                    v.replace(self.proxy_base, client_base)
+                    if isinstance(v, str) and self.proxy_base in v
+                    else v
+                ),
+            )
+            for k, v in headers
+            if k.lower() not in IGNORE_HEADERS
+        )
+
+
+class ProxyServer(BaseProxyServer):
     def __init__(
-        self, host: str, port: int, upstream_host: str, upstream_port: int
+        self,
+        host: str,
+        port: int,
+        upstream_host: str,
+        upstream_port: int,
+        pool_size: int = 16,
+        pool_idle_timeout: float = 30,
+        cache: HttpCache | None = None,
+        network: NetworkProfile | None = None,
     ) -> None:
-        proxied_urls: List[str] = []
-        self.urls: List[str] = proxied_urls
+        super().__init__(
+            host=host,
+            upstream_host=upstream_host,
+            upstream_port=upstream_port,
+            cache=cache,
+            network=network,
+        )
+        self.pool: ConnectionPool = ConnectionPool(
+            host=upstream_host,
+            port=upstream_port,
+            size=pool_size,
+            idle_timeout=pool_idle_timeout,
+        )
+        proxy_server: ProxyServer = self
+
+        # The listening socket is bound first, so that port 0 can be used to let
+        # the operating system pick a free port
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
+            (host, port), BaseHTTPRequestHandler, bind_and_activate=False
+        )
+        # the default backlog of 5 makes concurrent engine connections wait for
+        # retransmissions of the connection attempt
+        self.server.request_queue_size = LISTEN_BACKLOG
+        self.server.server_bind()
+        self.server.server_activate()
+        self.port = self.server.server_address[1]
 
-        listen_base: str = f"http://{host}:{port}"
-        proxy_base: str = f"http://{upstream_host}:{upstream_port}"
+        listen_base: str = self.get_listen_base()
+        proxy_base: str = self.proxy_base
 
         info(f"Proxy server: <{listen_base}> to <{proxy_base}>")
 
         class ProxyHTTPRequestHandler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps the connections from the engine alive as well
+            protocol_version: str = "HTTP/1.1"
+            # headers and body are written separately, which would otherwise be
+            # delayed by the Nagle algorithm
+            disable_nagle_algorithm: bool = True
+
+            record: ProxyRequest | None = None
+            throttle: Throttle | None = None
+
+            def setup(self) -> None:
+                super().setup()
+                # bandwidth is limited per connection from the engine
+                if proxy_server.network:
+                    self.throttle = proxy_server.network.get_throttle()
+
+            def request_upstream(
+                self, session: ProxySession, path: str, headers: Dict[str, str]
+            ) -> Tuple[HTTPConnection, HTTPResponse]:
+                connection, reused = proxy_server.pool.acquire()
+                session.add_pool_use(reused)
+                try:
+                    if not reused:
+                        time_connect: int = monotonic_ns()
+                        connection.connect()
+                        self.record.connect = monotonic_ns() - time_connect
+                    connection.request(method=self.command, url=path, headers=headers)
+                    response: HTTPResponse = connection.getresponse()
+                    self.record.set_first_byte()
+                    return connection, response
+                except ConnectionError as ex:
+                    connection.close()
+                    if not reused:
+                        raise ex
+                # a pooled connection may have been closed by the upstream while idle
+                debug(f"Retrying with a new connection after failure on {path}")
+                return self.request_upstream(session, path, headers)
+
+            def send_response(self, code: int, message: str | None = None) -> None:
+                if self.record:
+                    self.record.status = code
+                return super().send_response(code, message)
+
+            def send_head(
+                self, status: int, headers: Iterable[Tuple[str, str]], client_base: str
+            ) -> bool:
+                self.send_response(code=status)
+                for k, v in proxy_server.get_client_headers(headers, client_base):
+                    if k.lower() == "content-type":
+                        self.record.content_type = v
+                    self.send_header(k, v)
+                if self.command == "HEAD" or status in (
+                    HTTPStatus.NO_CONTENT,
+                    HTTPStatus.NOT_MODIFIED,
+                ):
+                    self.end_headers()
+                    return False
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                return True
+
+            def relay_body(
+                self,
+                chunks: Iterable[bytes],
+                rewriter: StreamRewriter,
+                recording: bytearray | None = None,
+            ) -> None:
+                for chunk in chunks:
+                    if recording is not None:
+                        recording.extend(chunk)
+                    data: bytes = rewriter.feed(chunk)
+                    if data:
+                        self.write_chunk(data)
+                data = rewriter.flush()
+                if data:
+                    self.write_chunk(data)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, data: bytes) -> None:
+                if self.throttle:
+                    sleep(self.throttle.get_wait(len(data)))
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+                self.record.size += len(data)
+
+            def release_upstream(
+                self, connection: HTTPConnection, response: HTTPResponse
+            ) -> None:
+                # the response is only complete, and the connection reusable, once
+                # the rest of the body has been consumed
+                response.read()
+                if response.will_close:
+                    connection.close()
+                else:
+                    proxy_server.pool.release(connection)
+
+            def replay_response(self, cached: CachedResponse, client_base: str) -> None:
+                if cached.status >= 400:
+                    self.send_error(cached.status)
+                elif self.send_head(cached.status, cached.headers, client_base):
+                    body: BytesIO = BytesIO(cached.body)
+                    self.relay_body(
+                        iter(lambda: body.read(CHUNK_SIZE), b""),
+                        StreamRewriter(proxy_base.encode(), client_base.encode()),
+                    )
+
             def proxy_request(self) -> None:
+                connection: HTTPConnection | None = None
                 response: HTTPResponse | None = None
                 try:
-                    target_url = f"{proxy_base}{self.path}"
-                    proxied_urls.append(target_url)
-                    proxied_headers = {
-                        k: v for k, v in self.headers.items() if k.lower() != "host"
-                    }
-                    request: Request = Request(
-                        url=target_url,
-                        headers=proxied_headers,
-                        method=self.command,
-                    )
-                    response: HTTPResponse = urlopen(request)
-                    self.send_response(code=response.status)
-                    for k, v in response.headers.items():
-                        if k.lower() not in IGNORE_HEADERS:
-                            self.send_header(
-                                k,
-                                v.replace(proxy_base, listen_base)
-                                if isinstance(v, str) and proxy_base in v
-                                else v,
+                    session, path = proxy_server.get_session(self.path)
+                    client_base: str = f"{listen_base}{session.base}"
+                    self.record = ProxyRequest(session, f"{proxy_base}{path}")
+                    if proxy_server.network:
+                        sleep(
+                            proxy_server.network.get_delay(
+                                f"{proxy_base}{path}", session.replication
                             )
-                    self.end_headers()
-                    if response.chunked and response.chunk_left:
-                        while response.chunk_left:
-                            self.wfile.write(
-                                response.read(response.chunk_left)
-                                .decode()
-                                .replace(proxy_base, listen_base)
-                                .encode()
-                            )
-                    else:
-                        self.wfile.write(
-                            response.read()
-                            .decode()
-                            .replace(proxy_base, listen_base)
-                            .encode()
                         )
-                except HTTPError as ex:
-                    self.send_error(ex.code)
-                except ConnectionResetError as ex:
-                    self.send_error(HTTPStatus.BAD_GATEWAY.value)
-                except URLError as ex:
+                    cache: HttpCache | None = proxy_server.cache
+                    cache_key: str | None = None
+                    recording: bytearray | None = None
+                    if cache:
+                        cache_key = cache.get_key(
+                            self.command, path, self.headers.get("accept")
+                        )
+                        cached: CachedResponse | None = cache.get(cache_key)
+                        self.record.set_first_byte()
+                        session.add_cache_use(cached is not None)
+                        if cached:
+                            self.replay_response(cached, client_base)
+                            return
+                        elif cache.mode == "replay":
+                            error(f"No recorded response for {proxy_base}{path}")
+                            self.send_error(HTTPStatus.BAD_GATEWAY.value)
+                            return
+                        recording = bytearray()
+                    connection, response = self.request_upstream(
+                        session,
+                        path,
+                        proxy_server.get_upstream_headers(self.headers.items()),
+                    )
+                    if response.status >= 400:
+                        self.release_upstream(connection, response)
+                        connection = None
+                        # error responses are not recorded, so that a transient
+                        # upstream failure is not replayed in every later run
+                        self.send_error(response.status)
+                        return
+                    if self.send_head(
+                        response.status, response.headers.items(), client_base
+                    ):
+                        self.relay_body(
+                            iter(lambda: response.read1(CHUNK_SIZE), b""),
+                            StreamRewriter(proxy_base.encode(), client_base.encode()),
+                            recording,
+                        )
+                    # the remaining length is left over when the upstream closed the
+                    # connection before the end of the body
+                    complete: bool = not response.length
+                    self.release_upstream(connection, response)
+                    connection = None
+                    if cache and cache_key and recording is not None and complete:
+                        cache.put(
+                            cache_key,
+                            CachedResponse(
+                                status=response.status,
+                                headers=response.headers.items(),
+                                body=bytes(recording),
+                            ),
+                        )
+                except ConnectionError as ex:
                     error(ex)
-                    self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR.value)
+                    self.send_error(HTTPStatus.BAD_GATEWAY.value)
                 except Exception as ex:
                     exception(ex)
                     self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR.value)
                 finally:
-                    if response and not response.closed:
-                        response.close()
+                    if connection:
+                        connection.close()
+                    if self.record:
+                        session.add_request(self.record)
+                        self.record = None
 
             def send_error(
                 self, code: int, message: str | None = None, explain: str | None = None
@@ -110,9 +481,7 @@ class ProxyServer:
             def log_error(self, format: str, *args: Any) -> None:
                 error(f"{args[0]} {proxy_base}{self.path}")
 
-        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
-            (host, port), ProxyHTTPRequestHandler
-        )
+        self.server.RequestHandlerClass = ProxyHTTPRequestHandler
 
         self.thread: Thread = Thread(target=self.server.serve_forever, daemon=True)
 
@@ -123,9 +492,8 @@ class ProxyServer:
     def stop(self) -> None:
         self.server.shutdown()
         self.thread.join()
+        # the listening socket is only closed once the server is no longer serving
+        self.server.server_close()
+        self.pool.close()
+        info(f"Connection pool hits {self.pool.hits} misses {self.pool.misses}")
         info("Stopped proxy server")
-
-    def reset(self) -> List[str]:
-        urls = list(u for u in self.urls)
-        self.urls.clear()
-        return urls
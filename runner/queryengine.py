@@ -1,19 +1,57 @@
-from json import dumps
+from json import dumps, loads
 from pathlib import Path
-from time import time_ns
-from logging import error
+from time import monotonic_ns
+from logging import error, info
 from datetime import timedelta
-from typing import Dict, Any, List
-from subprocess import Popen, PIPE
-from threading import Timer
-from re import Pattern, Match, compile
+from typing import Deque, Dict, Any, IO, Iterable, List, Set, Tuple
+from subprocess import Popen, PIPE, TimeoutExpired
+from threading import Event, Lock, Thread, Timer
+from collections import deque
 
 from experiment.result import Result
 
-RESULT_PATTERN: Pattern = compile(r"(?P<result>{.*})")
+from runner.outputparser import OUTPUT_PARSERS, OutputParser
+from runner.sampler import PROC, ProcessSampler
+
+# The persistent engine process used in the warm execution mode
+ENGINE_WORKER: Path = Path(__file__).parent.joinpath("engine-worker.js")
+
+
+class StderrCapture:
+    """Drains the stderr of an engine into a bounded buffer of timestamped lines"""
+
+    def __init__(self, stream: IO[bytes], size: int, ns_start: int) -> None:
+        self.lines: Deque[Tuple[int, str]] = deque(maxlen=size)
+        self.dropped: int = 0
+        self.ns_start: int = ns_start
+        self.lock: Lock = Lock()
+        self.thread: Thread = Thread(target=self.drain, args=(stream,), daemon=True)
+        self.thread.start()
+
+    def drain(self, stream: IO[bytes]) -> None:
+        for line in stream:
+            ns_line: int = monotonic_ns() - self.ns_start
+            with self.lock:
+                if len(self.lines) == self.lines.maxlen:
+                    # the oldest lines are dropped first
+                    self.dropped += 1
+                self.lines.append((ns_line, line.decode(errors="replace").rstrip()))
+
+    def reset(self, ns_start: int) -> None:
+        with self.lock:
+            self.lines.clear()
+            self.dropped = 0
+            self.ns_start = ns_start
+
+    def collect(self, result: Result) -> None:
+        with self.lock:
+            result.stderr = list(self.lines)
+            result.stderr_dropped = self.dropped
 
 
 class QueryEngine:
+    mode: str = "cold"
+
     def __init__(
         self,
         cwd: Path,
@@ -21,28 +59,141 @@ class QueryEngine:
         node: Path,
         env: Dict[str, str],
         context: Dict[str, Any] | None,
+        output_format: str = "application/json",
+        parse: str = "deferred",
+        stderr_lines: int = 10000,
+        sample_interval: float = 0.1,
     ) -> None:
         self.cwd: Path = cwd
         self.bin: Path = bin
         self.node: Path = node
         self.env: Dict[str, str] = env
         self.context: str | None = dumps(context) if context else None
+        self.output_format: str = output_format
+        self.parse: str = parse
+        self.stderr_lines: int = stderr_lines
+        self.sample_interval: float = sample_interval
+        # The samplers of the running executions, to report their current memory
+        self.samplers: Set[ProcessSampler] = set()
+        self.samplers_lock: Lock = Lock()
+
+    def get_context(self, rebase: Tuple[str, str] | None) -> str | None:
+        # The base URL in the context can be swapped for another one, such as a
+        # proxy session, and is swapped back in the output to keep results stable
+        base_from, base_to = rebase or ("", "")
+        return (
+            self.context.replace(base_from, base_to)
+            if self.context and base_from
+            else self.context
+        )
+
+    def get_query(self, query_string: str, rebase: Tuple[str, str] | None) -> str:
+        # seed IRIs in the query itself have to go through the session as well
+        base_from, base_to = rebase or ("", "")
+        return query_string.replace(base_from, base_to) if base_from else query_string
+
+    def start_sampler(
+        self, proc: Popen, ns_start: int, new_process: bool
+    ) -> ProcessSampler | None:
+        # the process information is read from procfs, which is only on Linux
+        if self.sample_interval <= 0 or not PROC.exists():
+            return None
+        sampler: ProcessSampler = ProcessSampler(
+            pid=proc.pid,
+            interval=self.sample_interval,
+            ns_start=ns_start,
+            new_process=new_process,
+        )
+        with self.samplers_lock:
+            self.samplers.add(sampler)
+        return sampler
+
+    def stop_sampler(self, sampler: ProcessSampler, result: Result) -> None:
+        sampler.stop()
+        sampler.collect(result)
+        with self.samplers_lock:
+            self.samplers.discard(sampler)
+
+    def get_rss(self) -> int:
+        with self.samplers_lock:
+            return sum(sampler.get_rss() for sampler in self.samplers)
+
+    def read_output(
+        self,
+        stdout: IO[bytes],
+        parser: OutputParser,
+        result: Result,
+        ns_start: int,
+        rebase: Tuple[str, str] | None,
+    ) -> Tuple[List[Tuple[int, bytes]], bool]:
+        # Only the raw lines and their arrival times are collected by default, so
+        # that the time taken to parse a line does not delay reading the next one
+        lines: List[Tuple[int, bytes]] = []
+        for line in stdout:
+            ns_line: int = monotonic_ns() - ns_start
+            if parser.terminator and line.rstrip().endswith(parser.terminator):
+                # when the result bindings are done, the reading loop can be terminated
+                return lines, True
+            if self.parse == "inline":
+                self.parse_output(((ns_line, line),), parser, result, rebase)
+            else:
+                lines.append((ns_line, line))
+        return lines, False
+
+    def parse_output(
+        self,
+        lines: Iterable[Tuple[int, bytes]],
+        parser: OutputParser,
+        result: Result,
+        rebase: Tuple[str, str] | None,
+    ) -> None:
+        base_from, base_to = rebase or ("", "")
+        for ns_line, line in lines:
+            text: str = line.decode(errors="replace")
+            if base_from:
+                text = text.replace(base_to, base_from)
+            for record in parser.parse(text):
+                if isinstance(record, str):
+                    result.add_other(ns_line, record)
+                else:
+                    result.add_result(ns_line, record)
+
+    def flush_output(self, parser: OutputParser, result: Result, ns_end: int) -> None:
+        for record in parser.flush():
+            result.add_other(ns_end, record)
 
     def query_bindings(
-        self, query_id: str, query_string: str, timeout: timedelta, config_path: Path
+        self,
+        query_id: str,
+        query_string: str,
+        timeout: timedelta,
+        config_path: Path,
+        rebase: Tuple[str, str] | None = None,
+        node_args: List[str] | None = None,
     ) -> Result:
         result: Result = Result(config=config_path.as_uri(), query=query_id)
+        result.engine_mode = self.mode
+        result.engine_output_format = self.output_format
+        result.engine_output_parse = self.parse
 
+        # Additional Node arguments, such as profiler flags, go before the script
         args: List[str] = [
             self.node.as_posix(),
+            *(node_args or ()),
             self.bin.as_posix(),
             "--query",
-            query_string,
+            self.get_query(query_string, rebase),
         ]
 
-        if self.context:
+        if self.output_format != "application/json":
+            args.append("--outputType")
+            args.append(self.output_format)
+
+        context: str | None = self.get_context(rebase)
+
+        if context:
             args.append("--context")
-            args.append(self.context)
+            args.append(context)
 
         result.begin()
 
@@ -50,44 +201,206 @@ class QueryEngine:
             args=args,
             env={**self.env, "COMUNICA_CONFIG": config_path.as_posix()},
             cwd=self.cwd,
-            encoding="utf-8",
             stdout=PIPE,
             stderr=PIPE,
         )
 
-        timer: Timer = Timer(interval=timeout.total_seconds(), function=proc.terminate)
+        # stderr is drained from the start, so that the engine never blocks on
+        # writing to a full pipe, and is timestamped on the same clock as stdout
+        ns_start: int = monotonic_ns()
+        stderr: StderrCapture = StderrCapture(
+            stream=proc.stderr, size=self.stderr_lines, ns_start=ns_start
+        )
+        sampler: ProcessSampler | None = self.start_sampler(proc, ns_start, True)
+
+        # The exit code is not yet available when the output ends right as the
+        # process is terminated, so the timeout is tracked separately
+        timed_out: Event = Event()
+
+        def terminate() -> None:
+            timed_out.set()
+            proc.terminate()
+
+        timer: Timer = Timer(interval=timeout.total_seconds(), function=terminate)
         timer.start()
 
-        ns_start: int = time_ns()
+        parser: OutputParser = OUTPUT_PARSERS[self.output_format]()
 
-        for line in proc.stdout:
-            ns_line: int = time_ns() - ns_start
-            line: str = line.strip().removesuffix(",").removeprefix("[").strip()
-            if not line:
-                # skip empty lines
-                continue
-            elif line.endswith("]"):
-                # when the result bindings are done, the reading loop can be terminated
-                break
-            line_match: Match[str] | None = RESULT_PATTERN.match(line)
-            if line_match:
-                query_result: str = line_match.group("result")
-                result.add_result(ns_line, query_result)
-                line = line.replace(query_result, "").strip()
-            if line:
-                result.add_result(ns_line, line)
+        lines, _ = self.read_output(proc.stdout, parser, result, ns_start, rebase)
+        ns_end: int = monotonic_ns() - ns_start
 
         result.end()
         timer.cancel()
 
+        if sampler:
+            self.stop_sampler(sampler, result)
+
+        self.parse_output(lines, parser, result, rebase)
+        self.flush_output(parser, result, ns_end)
+
+        if node_args and not timed_out.is_set():
+            # Node writes profiles only when exiting normally, so the process is
+            # allowed to exit by itself within the remaining time
+            try:
+                proc.wait(timeout=max(timeout.total_seconds() - ns_end / 1e9, 0))
+            except TimeoutExpired:
+                error(f"Engine did not exit after the output for {config_path}")
+
         returncode: int | None = proc.poll()
 
         proc.terminate()
+        proc.wait()
+        stderr.thread.join()
+
+        if timed_out.is_set() or (returncode and returncode != 1):
+            error(f"Timeout reached after {timeout.total_seconds()} seconds")
+            result.timeout = True
+
+        stderr.collect(result)
+
+        return result
+
+    def stop(self) -> None:
+        pass
+
+
+class WarmQueryEngine(QueryEngine):
+    mode: str = "warm"
+
+    def __init__(
+        self,
+        cwd: Path,
+        bin: Path,
+        node: Path,
+        env: Dict[str, str],
+        context: Dict[str, Any] | None,
+        parse: str = "deferred",
+        stderr_lines: int = 10000,
+        sample_interval: float = 0.1,
+        worker: Path | None = None,
+    ) -> None:
+        # The engine worker always prints the bindings in the default format
+        super().__init__(
+            cwd=cwd,
+            bin=bin,
+            node=node,
+            env=env,
+            context=context,
+            parse=parse,
+            stderr_lines=stderr_lines,
+            sample_interval=sample_interval,
+        )
+        self.worker: Path = worker or ENGINE_WORKER
+        self.processes: Dict[Path, Popen] = {}
+        self.stderr: Dict[Path, StderrCapture] = {}
+
+    def start_process(self, config_path: Path) -> Tuple[Popen, float]:
+        ns_start: int = monotonic_ns()
+        proc: Popen = Popen(
+            args=[self.node.as_posix(), self.worker.as_posix(), self.cwd.as_posix()],
+            env={**self.env, "COMUNICA_CONFIG": config_path.as_posix()},
+            cwd=self.cwd,
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+        )
+        # stderr is drained in the background for the lifetime of the process, so
+        # that the engine never blocks on a full pipe between queries
+        stderr: StderrCapture = StderrCapture(
+            stream=proc.stderr, size=self.stderr_lines, ns_start=ns_start
+        )
+        ready: bytes = proc.stdout.readline().strip()
+        startup_seconds: float = (monotonic_ns() - ns_start) / 1e9
+        if ready != b"ready":
+            proc.wait()
+            stderr.thread.join()
+            raise Exception(
+                f"Failed to start engine for {config_path}: "
+                + "\n".join(line for _, line in stderr.lines)
+            )
+        info(f"Started warm engine in {startup_seconds} seconds for {config_path}")
+        self.processes[config_path] = proc
+        self.stderr[config_path] = stderr
+        return proc, startup_seconds
+
+    def query_bindings(
+        self,
+        query_id: str,
+        query_string: str,
+        timeout: timedelta,
+        config_path: Path,
+        rebase: Tuple[str, str] | None = None,
+        node_args: List[str] | None = None,
+    ) -> Result:
+        result: Result = Result(config=config_path.as_uri(), query=query_id)
+        result.engine_mode = self.mode
+        result.engine_output_format = self.output_format
+        result.engine_output_parse = self.parse
+        result.engine_startup_seconds = 0
 
-        if returncode and returncode != 1:
+        proc: Popen | None = self.processes.get(config_path)
+        if not proc or proc.poll() is not None:
+            proc, result.engine_startup_seconds = self.start_process(config_path)
+        stderr: StderrCapture = self.stderr[config_path]
+
+        context: str | None = self.get_context(rebase)
+
+        timed_out: Event = Event()
+
+        def terminate() -> None:
+            timed_out.set()
+            proc.terminate()
+
+        result.begin()
+
+        ns_start: int = monotonic_ns()
+        stderr.reset(ns_start)
+        sampler: ProcessSampler | None = self.start_sampler(proc, ns_start, False)
+
+        request: str = dumps(
+            {
+                "query": self.get_query(query_string, rebase),
+                "context": loads(context) if context else {},
+            }
+        )
+        proc.stdin.write(f"{request}\n".encode())
+        proc.stdin.flush()
+
+        timer: Timer = Timer(interval=timeout.total_seconds(), function=terminate)
+        timer.start()
+
+        parser: OutputParser = OUTPUT_PARSERS[self.output_format]()
+
+        lines, completed = self.read_output(
+            proc.stdout, parser, result, ns_start, rebase
+        )
+        ns_end: int = monotonic_ns() - ns_start
+
+        result.end()
+        timer.cancel()
+
+        if sampler:
+            self.stop_sampler(sampler, result)
+
+        self.parse_output(lines, parser, result, rebase)
+        self.flush_output(parser, result, ns_end)
+
+        if timed_out.is_set():
             error(f"Timeout reached after {timeout.total_seconds()} seconds")
             result.timeout = True
 
-        result.stderr = proc.stderr.read()
+        if not completed:
+            # the process is started again for the next query
+            proc.wait()
+            stderr.thread.join()
+            del self.processes[config_path]
+
+        stderr.collect(result)
 
         return result
+
+    def stop(self) -> None:
+        for proc in self.processes.values():
+            proc.terminate()
+            proc.wait()
+        self.processes.clear()
@@ -0,0 +1,158 @@
+from math import sqrt
+from threading import Lock
+from typing import Dict, List, Tuple
+
+REPLICATION_MODES: Tuple[str, ...] = ("fixed", "adaptive")
+
+# Two-sided 95% quantiles of the t-distribution by degrees of freedom, with the
+# normal distribution used beyond the table
+T_QUANTILES: Tuple[float, ...] = (
+    12.706,
+    4.303,
+    3.182,
+    2.776,
+    2.571,
+    2.447,
+    2.365,
+    2.306,
+    2.262,
+    2.228,
+    2.201,
+    2.179,
+    2.160,
+    2.145,
+    2.131,
+    2.120,
+    2.110,
+    2.101,
+    2.093,
+    2.086,
+    2.080,
+    2.074,
+    2.069,
+    2.064,
+    2.060,
+    2.056,
+    2.052,
+    2.048,
+    2.045,
+    2.042,
+)
+
+
+def get_relative_confidence_interval(times: List[float]) -> float:
+    """Half-width of the 95% confidence interval of the mean, relative to the mean"""
+    if len(times) < 2:
+        return float("inf")
+    mean: float = sum(times) / len(times)
+    if mean <= 0:
+        return float("inf")
+    variance: float = sum((t - mean) ** 2 for t in times) / (len(times) - 1)
+    quantile: float = (
+        T_QUANTILES[len(times) - 2] if len(times) - 1 <= len(T_QUANTILES) else 1.960
+    )
+    return quantile * sqrt(variance / len(times)) / mean
+
+
+class Replication:
+    """The executions of a single query and config pair so far"""
+
+    def __init__(self) -> None:
+        self.times: List[float] = []
+        self.seconds: float = 0
+        self.executions: int = 0
+        self.timeouts: int = 0
+        self.stop_reason: str | None = None
+
+
+class ReplicationPolicy:
+    """Decides when to stop replicating a query and config pair"""
+
+    def __init__(
+        self,
+        mode: str,
+        maximum: int,
+        minimum: int,
+        confidence_target: float,
+        timeout_limit: int,
+    ) -> None:
+        self.mode: str = mode
+        self.maximum: int = maximum
+        self.minimum: int = min(max(minimum, 2), maximum)
+        self.confidence_target: float = confidence_target
+        self.timeout_limit: int = timeout_limit
+        self.lock: Lock = Lock()
+        self.replications: Dict[Tuple[str, str], Replication] = {}
+
+    def get_replication(self, query: str, config: str) -> Replication:
+        if (query, config) not in self.replications:
+            self.replications[(query, config)] = Replication()
+        return self.replications[(query, config)]
+
+    def get_stop_reason(self, query: str, config: str) -> str | None:
+        with self.lock:
+            return self.get_replication(query, config).stop_reason
+
+    def add(self, query: str, config: str, seconds: float, timeout: bool) -> str | None:
+        """Register a finished execution, and return the reason if the pair stopped"""
+        with self.lock:
+            replication: Replication = self.get_replication(query, config)
+            if replication.stop_reason:
+                return None
+            replication.executions += 1
+            replication.seconds += seconds
+            if timeout:
+                replication.timeouts += 1
+            else:
+                replication.times.append(seconds)
+                replication.timeouts = 0
+            if replication.executions >= self.maximum:
+                replication.stop_reason = "replication_limit"
+            elif self.mode == "adaptive":
+                # Only the timeouts in a row are counted, so a pair that recovers
+                # after a slow start is still replicated
+                if (
+                    self.timeout_limit > 0
+                    and replication.timeouts >= self.timeout_limit
+                ):
+                    replication.stop_reason = "timeout_limit"
+                elif (
+                    len(replication.times) >= self.minimum
+                    and get_relative_confidence_interval(replication.times)
+                    <= self.confidence_target
+                ):
+                    replication.stop_reason = "confidence_target"
+            return replication.stop_reason
+
+    def get_expected_seconds(
+        self,
+        pairs: List[Tuple[str, str]],
+        durations: Dict[Tuple[str, str], float],
+        default: float,
+    ) -> float:
+        """Expected time of the remaining executions, using the observed means"""
+        with self.lock:
+            executions: int = sum(r.executions for r in self.replications.values())
+            # Pairs without executions use their previous durations if known
+            fallback: float = (
+                sum(r.seconds for r in self.replications.values()) / executions
+                if executions
+                else default
+            )
+            seconds: float = 0
+            for query, config in pairs:
+                replication: Replication = self.get_replication(query, config)
+                if replication.stop_reason:
+                    continue
+                expected: int = self.maximum - replication.executions
+                if self.mode == "adaptive":
+                    expected = min(
+                        max(self.minimum - len(replication.times), 1), expected
+                    )
+                mean: float = (
+                    replication.seconds / replication.executions
+                    if replication.executions
+                    else durations.get((query, config), fallback)
+                )
+                seconds += max(expected, 0) * mean
+            return seconds
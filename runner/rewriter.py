@@ -0,0 +1,26 @@
+from typing import List
+
+
+class StreamRewriter:
+    def __init__(self, old: bytes, new: bytes) -> None:
+        self.old: bytes = old
+        self.new: bytes = new
+        self.pending: bytes = b""
+
+    def feed(self, data: bytes) -> bytes:
+        parts: List[bytes] = (self.pending + data).split(self.old)
+        tail: bytes = parts[-1]
+        # The end of the data may be the beginning of a match that continues in the
+        # next chunk, so the longest such suffix is held back until then
+        keep: int = min(len(tail), len(self.old) - 1)
+        while keep > 0 and not tail.endswith(self.old[:keep]):
+            keep -= 1
+        cut: int = len(tail) - keep
+        self.pending = tail[cut:]
+        parts[-1] = tail[:cut]
+        return self.new.join(parts)
+
+    def flush(self) -> bytes:
+        pending: bytes = self.pending
+        self.pending = b""
+        return pending
@@ -1,93 +1,460 @@
 from pathlib import Path
-from logging import exception, info
+from queue import Queue, Empty
+from logging import info, warning
+from random import randrange
 from datetime import timedelta
+from threading import Event, Lock, Thread
+from sqlite3 import Row
+from time import monotonic_ns
+from collections import deque
+from typing import Any, Deque, Dict, List, Set, Tuple, Type
 
 from experiment.experiment import Experiment
-from experiment.result import Result, save_result
+from experiment.result import Result, save_result, discard_partial_results
+from experiment.index import ResultIndex
 
-from runner.queryengine import QueryEngine
-from runner.proxyserver import ProxyServer
+from runner.journal import ExperimentJournal
+from runner.metricsserver import MetricsServer
+from runner.profiler import EngineProfiler
+from runner.fingerprint import ExecutionFingerprints
+from runner.replication import ReplicationPolicy
+from runner.scheduler import Execution, ExecutionScheduler
+from runner.worker import ExperimentWorker
+from runner.queryengine import QueryEngine, WarmQueryEngine
+from runner.proxyserver import BaseProxyServer, ProxyServer
+from runner.asyncproxyserver import AsyncProxyServer
+from runner.httpcache import HttpCache
+from runner.network import NetworkProfile
+
+PROXY_SERVERS: Dict[str, Type[BaseProxyServer]] = {
+    "threading": ProxyServer,
+    "asyncio": AsyncProxyServer,
+}
+
+
+# The proxy request count is sampled on this interval while the metrics are served,
+# and the request rate is reported over the window of recent samples
+METRICS_SAMPLE_INTERVAL: float = 1
+METRICS_RATE_WINDOW: float = 60
+
+
+def format_duration(seconds: int) -> str:
+    duration: str = ""
+    days, remainder = divmod(seconds, 60 * 60 * 24)
+    if days > 0:
+        duration += f" {days} days"
+    hours, remainder = divmod(remainder, 60 * 60)
+    if hours > 0:
+        duration += f" {hours} hours"
+    minutes, seconds = divmod(remainder, 60)
+    if minutes > 0:
+        duration += f" {minutes} minutes"
+    if seconds > 0 or not duration:
+        duration += f" {seconds} seconds"
+    return duration.strip()
 
 
 class ExperimentRunner:
-    def __init__(self, manifest: Path) -> None:
+    def __init__(
+        self,
+        manifest: Path,
+        workers: int = 1,
+        parse: str = "deferred",
+        resume: bool = False,
+        force: bool = False,
+    ) -> None:
         self.experiment: Experiment = Experiment(path=manifest)
-        self.proxy_server: ProxyServer = ProxyServer(
+        self.parse: str = parse
+        self.resume: bool = resume
+        self.force: bool = force
+        proxy_server_type: Type[BaseProxyServer] = PROXY_SERVERS[
+            self.experiment.proxy_server_implementation
+        ]
+        self.proxy_server: BaseProxyServer = proxy_server_type(
             host=self.experiment.proxy_server_host,
             port=self.experiment.proxy_server_port,
             upstream_host=self.experiment.proxy_server_upstream_host,
             upstream_port=self.experiment.proxy_server_upstream_port,
+            pool_size=self.experiment.proxy_server_pool_size,
+            pool_idle_timeout=self.experiment.proxy_server_pool_idle_timeout,
+            cache=(
+                HttpCache(
+                    path=self.experiment.proxy_server_cache_path,
+                    mode=self.experiment.proxy_server_cache_mode,
+                    memory_size=self.experiment.proxy_server_cache_memory,
+                )
+                if self.experiment.proxy_server_cache_mode != "passthrough"
+                else None
+            ),
+            network=(
+                NetworkProfile(**self.experiment.proxy_server_network)
+                if self.experiment.proxy_server_network
+                else None
+            ),
+        )
+        # In the cold mode, every execution starts a new engine process so a single
+        # engine is shared, while warm engines keep one process per worker alive
+        self.query_engine: QueryEngine = self.create_query_engine()
+        self.workers: List[ExperimentWorker] = list(
+            ExperimentWorker(
+                index=i,
+                experiment=self.experiment,
+                proxy_server=self.proxy_server,
+                query_engine=(
+                    self.create_query_engine()
+                    if self.experiment.query_engine_mode == "warm"
+                    else self.query_engine
+                ),
+            )
+            for i in range(0, max(workers, 1))
+        )
+        self.replication_policy: ReplicationPolicy = ReplicationPolicy(
+            mode=self.experiment.replication_mode,
+            maximum=self.experiment.replication,
+            minimum=self.experiment.replication_min,
+            confidence_target=self.experiment.replication_confidence_target,
+            timeout_limit=self.experiment.replication_timeout_limit,
+        )
+        self.pairs: List[Tuple[str, str]] = list(
+            (query_id, config_path.as_posix())
+            for query_id in self.experiment.query_strings
+            for config_path in self.experiment.configs
+        )
+        self.profiler: EngineProfiler | None = self.create_profiler()
+        self.durations: Dict[Tuple[str, str], float] = {}
+        self.exec_lock: Lock = Lock()
+        self.exec_done: int = 0
+        self.exec_total: int = 0
+        self.exec_finished: int = 0
+        self.exec_timeouts: int = 0
+        # Recent proxy request counts with their times, for the request rate
+        self.proxy_requests: Deque[Tuple[int, int]] = deque(
+            maxlen=int(METRICS_RATE_WINDOW / METRICS_SAMPLE_INTERVAL) + 1
         )
-        self.query_engine: QueryEngine = QueryEngine(
+        self.proxy_requests_stopped: Event = Event()
+        self.metrics_server: MetricsServer | None = (
+            MetricsServer(
+                host=self.experiment.metrics_host,
+                port=self.experiment.metrics_port,
+                collect=self.get_metrics,
+            )
+            if self.experiment.metrics_port is not None
+            else None
+        )
+
+    def create_query_engine(self) -> QueryEngine:
+        if self.experiment.query_engine_mode == "warm":
+            return WarmQueryEngine(
+                cwd=self.experiment.query_engine_cwd,
+                bin=self.experiment.query_engine_bin,
+                node=self.experiment.query_engine_node,
+                env=self.experiment.query_engine_environment,
+                context=self.experiment.query_engine_context,
+                parse=self.parse,
+                stderr_lines=self.experiment.query_engine_stderr_lines,
+                sample_interval=self.experiment.query_engine_sample_interval,
+                worker=self.experiment.query_engine_worker,
+            )
+        return QueryEngine(
             cwd=self.experiment.query_engine_cwd,
             bin=self.experiment.query_engine_bin,
             node=self.experiment.query_engine_node,
             env=self.experiment.query_engine_environment,
             context=self.experiment.query_engine_context,
+            output_format=self.experiment.query_engine_output_format,
+            parse=self.parse,
+            stderr_lines=self.experiment.query_engine_stderr_lines,
+            sample_interval=self.experiment.query_engine_sample_interval,
         )
 
-    def get_total_execution_count(self) -> int:
+    def create_profiler(self) -> EngineProfiler | None:
+        options: Dict[str, Any] = self.experiment.query_engine_profile
+        if not (
+            options.get("queries") or options.get("configs") or options.get("fraction")
+        ):
+            return None
+        if self.experiment.query_engine_mode == "warm":
+            # the profiles are only written when the engine process exits
+            warning("Profiling is only supported in the cold engine mode")
+            return None
+        return EngineProfiler(self.experiment.results, options)
+
+    def get_total_execution_count(self, completed: int = 0) -> int:
         executions_total: int = (
             len(self.experiment.query_strings)
             * len(self.experiment.configs)
             * self.experiment.replication
-        )
+        ) - completed
+        if completed > 0:
+            info(f"Skipping {completed} experiments completed previously")
         info(f"Executing a total of {executions_total} experiments")
-        duration: str = "Maximum duration"
-        seconds = self.experiment.query_engine_timeout * executions_total
-        days, remainder = divmod(seconds, 60 * 60 * 24)
-        if days > 0:
-            duration += f" {days} days"
-        hours, remainder = divmod(remainder, 60 * 60)
-        if hours > 0:
-            duration += f" {hours} hours"
-        minutes, seconds = divmod(remainder, 60)
-        if minutes > 0:
-            duration += f" {minutes} minutes"
-        if seconds > 0:
-            duration += f" {seconds} seconds"
-        info(duration)
+        seconds: int = (
+            self.experiment.query_engine_timeout * executions_total // len(self.workers)
+        )
+        info(f"Maximum duration {format_duration(seconds)}")
+        info(f"Expected duration {format_duration(self.get_expected_seconds())}")
         return executions_total
 
+    def get_expected_seconds(self) -> int:
+        """Expected remaining time, with the timeout assumed until times are known"""
+        seconds: float = self.replication_policy.get_expected_seconds(
+            self.pairs, self.durations, self.experiment.query_engine_timeout
+        )
+        return int(seconds // len(self.workers))
+
+    def load_durations(self) -> Dict[Tuple[str, str], float]:
+        """Mean durations of the previous executions of each pair in the results"""
+        configs: Dict[str, str] = {
+            c.as_uri(): c.as_posix() for c in self.experiment.configs
+        }
+        return {
+            (row["query"], configs[row["config"]]): row["duration"]
+            for row in self.index.select(
+                "SELECT query, config, AVG(time_taken_seconds) AS duration "
+                "FROM executions GROUP BY query, config"
+            )
+            if row["config"] in configs
+        }
+
+    def create_scheduler(self) -> ExecutionScheduler:
+        seed: int = (
+            self.experiment.schedule_seed
+            if self.experiment.schedule_seed is not None
+            else randrange(2**32)
+        )
+        info(
+            f"Scheduling {self.experiment.schedule} with seed {seed} and "
+            f"{len(self.durations)} known durations"
+        )
+        return ExecutionScheduler(
+            schedule=self.experiment.schedule,
+            seed=seed,
+            durations=self.durations,
+            default=self.experiment.query_engine_timeout,
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Progress of the experiment, read from the existing counters on request"""
+        with self.exec_lock:
+            done: int = self.exec_finished
+            remaining: int = max(self.exec_total + 1 - done, 0)
+            timeouts: int = self.exec_timeouts
+        requests, in_flight, errors = self.proxy_server.get_request_counts()
+        ns_now: int = monotonic_ns()
+        with self.exec_lock:
+            ns_first, requests_first = (
+                self.proxy_requests[0] if self.proxy_requests else (ns_now, requests)
+            )
+        engines: Set[QueryEngine] = set(worker.query_engine for worker in self.workers)
+        return {
+            "executions_done_total": done,
+            "executions_remaining": remaining,
+            "executions_timeout_total": timeouts,
+            "eta_seconds": self.get_expected_seconds(),
+            "eta_maximum_seconds": (
+                self.experiment.query_engine_timeout * remaining // len(self.workers)
+            ),
+            "proxy_requests_total": requests,
+            "proxy_requests_per_second": (
+                round((requests - requests_first) / (ns_now - ns_first) * 1e9, 3)
+                if ns_now > ns_first
+                else 0
+            ),
+            "proxy_requests_in_flight": in_flight,
+            "proxy_errors_total": errors,
+            "engine_rss_bytes": sum(engine.get_rss() for engine in engines),
+        }
+
+    def sample_proxy_requests(self) -> None:
+        # The samples are taken on a fixed interval, so that the request rate does
+        # not depend on how often the metrics are requested
+        while True:
+            requests, _, _ = self.proxy_server.get_request_counts()
+            with self.exec_lock:
+                self.proxy_requests.append((monotonic_ns(), requests))
+            if self.proxy_requests_stopped.wait(METRICS_SAMPLE_INTERVAL):
+                return
+
     def execute(self) -> None:
-        exec_total: int = self.get_total_execution_count() - 1
-        exec_done: int = 0
+        if self.resume:
+            for path in discard_partial_results(self.experiment.results):
+                warning(f"Discarded partial result {path}")
+        self.journal: ExperimentJournal = ExperimentJournal(
+            self.experiment.results, self.resume
+        )
         query_timeout: timedelta = timedelta(
             seconds=self.experiment.query_engine_timeout
         )
-        self.proxy_server.start()
+        self.index: ResultIndex = ResultIndex(self.experiment.results)
+        self.fingerprints: ExecutionFingerprints = ExecutionFingerprints(
+            self.experiment, self.parse
+        )
+        # The results of a resumed experiment, and the executions with the same
+        # fingerprint in the results unless forced, count as replications
+        previous: Dict[str, Tuple[str, str]] = {
+            result_name: (query_id, config)
+            for (query_id, config, _), result_name in self.journal.completed.items()
+        }
+        cached: Dict[Tuple[str, str], int] = {}
+        if not self.force:
+            for query_id in self.experiment.query_strings:
+                for config_path in self.experiment.configs:
+                    rows: List[Row] = self.index.select(
+                        "SELECT path FROM executions WHERE fingerprint = ?",
+                        (self.fingerprints.get(query_id, config_path),),
+                    )
+                    cached[(query_id, config_path.as_posix())] = len(rows)
+                    for row in rows:
+                        previous[row["path"]] = (query_id, config_path.as_posix())
+            reused: int = sum(
+                min(c, self.experiment.replication) for c in cached.values()
+            )
+            info(f"Reusing {reused} executions with the same fingerprints")
+        for result_name, (query_id, config) in sorted(previous.items()):
+            for row in self.index.select(
+                "SELECT time_taken_seconds, timeout FROM executions WHERE path = ?",
+                (result_name,),
+            ):
+                self.replication_policy.add(
+                    query_id, config, row["time_taken_seconds"], bool(row["timeout"])
+                )
+        pending: List[Execution] = []
+        completed: int = 0
         for query_id, query_string in self.experiment.query_strings.items():
-            info(f"Executing query <{query_id}>")
             for config_path in self.experiment.configs:
                 for i in range(0, self.experiment.replication):
-                    info(f"Execute {exec_done} / {exec_total} <file://{config_path}>")
-                    result: Result | None = self.execute_query(
-                        query_id=query_id,
-                        query_string=query_string,
-                        config_path=config_path,
-                        timeout=query_timeout,
-                    )
-                    if result:
-                        info(f"Finished with {len(result.results)} results")
-                        save_result(self.experiment.results, result)
-                    exec_done += 1
+                    if self.journal.is_completed(query_id, config_path, i) or i < (
+                        cached.get((query_id, config_path.as_posix()), 0)
+                    ):
+                        completed += 1
+                    else:
+                        pending.append((query_id, query_string, config_path, i))
+        self.durations = self.load_durations()
+        self.scheduler: ExecutionScheduler = self.create_scheduler()
+        pending = self.scheduler.order(pending)
+        if self.experiment.replication_mode == "adaptive":
+            # Every pair is replicated once before any is replicated again, so that
+            # pairs can stop before their later replications are started
+            pending.sort(key=lambda execution: execution[3])
+        executions: Queue[Execution] = Queue()
+        for execution in pending:
+            executions.put(execution)
+        self.exec_total = self.get_total_execution_count(completed) - 1
+        self.exec_done = 0
+        self.exec_finished = 0
+        self.exec_timeouts = 0
+        makespan: float = self.scheduler.get_makespan(pending, len(self.workers))
+        info(f"Predicted makespan {format_duration(int(makespan))}")
+        info(f"Executing with {len(self.workers)} workers")
+        threads: List[Thread] = list(
+            Thread(
+                target=self.execute_worker,
+                args=(worker, executions, query_timeout),
+                name=f"worker-{worker.index}",
+            )
+            for worker in self.workers
+        )
+        self.proxy_server.start()
+        if self.metrics_server:
+            sampler: Thread = Thread(target=self.sample_proxy_requests, daemon=True)
+            sampler.start()
+            self.metrics_server.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for worker in self.workers:
+            worker.query_engine.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.proxy_requests_stopped.set()
+            sampler.join()
         self.proxy_server.stop()
+        if self.proxy_server.unattributed_requests:
+            warning(
+                f"{self.proxy_server.unattributed_requests} proxy requests were not "
+                "attributed to an execution"
+            )
+        self.index.close()
+        self.journal.close()
 
-    def execute_query(
+    def execute_worker(
         self,
-        query_id: str,
-        query_string: str,
-        config_path: Path,
+        worker: ExperimentWorker,
+        executions: Queue[Execution],
         timeout: timedelta,
-    ) -> Result | None:
-        try:
-            result: Result = self.query_engine.query_bindings(
+    ) -> None:
+        while True:
+            try:
+                query_id, query_string, config_path, replication = (
+                    executions.get_nowait()
+                )
+            except Empty:
+                break
+            stop_reason: str | None = self.replication_policy.get_stop_reason(
+                query_id, config_path.as_posix()
+            )
+            if stop_reason:
+                with self.exec_lock:
+                    self.exec_total -= 1
+                info(
+                    f"Worker {worker.index}: Skip replication {replication} of "
+                    f"<{query_id}> <file://{config_path}> due to {stop_reason}"
+                )
+                continue
+            with self.exec_lock:
+                exec_index: int = self.exec_done
+                self.exec_done += 1
+            info(
+                f"Worker {worker.index}: Execute {exec_index} / {self.exec_total} "
+                f"<{query_id}> <file://{config_path}>"
+            )
+            profile_directory: Path | None = (
+                self.profiler.create_directory()
+                if self.profiler
+                and self.profiler.is_selected(query_id, config_path, replication)
+                else None
+            )
+            result: Result | None = worker.execute_query(
                 query_id=query_id,
                 query_string=query_string,
-                timeout=timeout,
                 config_path=config_path,
+                timeout=timeout,
+                replication=replication,
+                node_args=(
+                    self.profiler.get_args(profile_directory)
+                    if profile_directory
+                    else None
+                ),
             )
-            result.urls = self.proxy_server.reset()
-            return result
-        except Exception as ex:
-            exception(ex)
+            if profile_directory:
+                profiles: List[str] = self.profiler.collect(profile_directory)
+                if result:
+                    result.engine_profiles = profiles
+            if result:
+                result.replication = replication
+                result.fingerprint = self.fingerprints.get(query_id, config_path)
+                # the order of the executions can be reproduced from the seed
+                result.schedule = self.scheduler.schedule
+                result.schedule_seed = self.scheduler.seed
+                result.replication_stop = self.replication_policy.add(
+                    query_id,
+                    config_path.as_posix(),
+                    result.get_time_taken_seconds(),
+                    result.timeout,
+                )
+                info(
+                    f"Worker {worker.index}: Finished with "
+                    f"{result.get_result_count()} results, expected remaining "
+                    f"{format_duration(self.get_expected_seconds())}"
+                )
+                result_path: Path = save_result(
+                    self.experiment.results, result, self.experiment.results_format
+                )
+                self.index.add_result(result_path, result)
+                # the journal entry is only written once the result is complete
+                self.journal.add(query_id, config_path, replication, result_path)
+            with self.exec_lock:
+                self.exec_finished += 1
+                if result and result.timeout:
+                    self.exec_timeouts += 1
@@ -0,0 +1,138 @@
+from os import sysconf
+from pathlib import Path
+from time import monotonic_ns
+from threading import Event, Lock, Thread
+from typing import Dict, List, Set, Tuple
+
+from experiment.result import SAMPLE_FIELDS, Result
+
+PROC: Path = Path("/proc")
+
+# Finding the children of a process reads the whole process table, so it is only
+# refreshed at this interval and the known processes are sampled in between
+DESCENDANTS_INTERVAL_NS: int = 1000 * 1000 * 1000
+
+SAMPLE_RSS: int = SAMPLE_FIELDS.index("rss_bytes")
+
+# Clock ticks per second, in which the CPU times in /proc/<pid>/stat are counted
+CLOCK_TICKS: int = sysconf("SC_CLK_TCK") if PROC.exists() else 100
+
+
+def read_status(pid: int) -> Dict[str, str]:
+    status: Dict[str, str] = {}
+    with open(PROC.joinpath(str(pid), "status"), "r") as status_file:
+        for line in status_file:
+            key, _, value = line.partition(":")
+            status[key] = value.strip()
+    return status
+
+
+def read_stat(pid: int) -> List[str]:
+    with open(PROC.joinpath(str(pid), "stat"), "r") as stat_file:
+        # the command name can contain spaces, so the fields after it are split
+        return stat_file.read().rpartition(")")[2].split()
+
+
+def get_descendants(pid: int) -> Set[int]:
+    """Find the process and its descendants by their parent process identifiers"""
+    children: Dict[int, List[int]] = {}
+    for path in PROC.iterdir():
+        if path.name.isdigit():
+            try:
+                children.setdefault(int(read_stat(int(path.name))[1]), []).append(
+                    int(path.name)
+                )
+            except (OSError, IndexError, ValueError):
+                # the process exited while iterating
+                continue
+    descendants: Set[int] = set()
+    pending: List[int] = [pid]
+    while pending:
+        current: int = pending.pop()
+        descendants.add(current)
+        pending.extend(children.get(current, ()))
+    return descendants
+
+
+class ProcessSampler:
+    """Samples the CPU time, memory and threads of an engine process and children"""
+
+    def __init__(
+        self, pid: int, interval: float, ns_start: int, new_process: bool
+    ) -> None:
+        self.pid: int = pid
+        self.interval: float = interval
+        self.ns_start: int = ns_start
+        # The peak RSS recorded by the kernel includes the previous queries of a
+        # warm engine, so only the sampled RSS is used for the peak in that case
+        self.new_process: bool = new_process
+        self.lock: Lock = Lock()
+        self.stopped: Event = Event()
+        # The CPU times of a warm engine include the previous queries, so they are
+        # recorded relative to the first sample instead of the process start
+        self.cpu_start: Tuple[float, float] | None = (0, 0) if new_process else None
+        self.samples: List[Tuple[int, float, float, int, int, int]] = []
+        self.peak_rss: int = 0
+        self.descendants: Set[int] = {pid}
+        self.ns_descendants: int = 0
+        self.thread: Thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def sample(self) -> None:
+        ns_sample: int = monotonic_ns() - self.ns_start
+        if ns_sample - self.ns_descendants >= DESCENDANTS_INTERVAL_NS:
+            self.descendants = get_descendants(self.pid)
+            self.ns_descendants = ns_sample
+        cpu_user: float = 0
+        cpu_system: float = 0
+        rss: int = 0
+        rss_peak: int = 0
+        threads: int = 0
+        for pid in self.descendants:
+            try:
+                stat: List[str] = read_stat(pid)
+                status: Dict[str, str] = read_status(pid)
+            except OSError:
+                continue
+            cpu_user += int(stat[11]) / CLOCK_TICKS
+            cpu_system += int(stat[12]) / CLOCK_TICKS
+            threads += int(stat[17])
+            # kernel threads and zombies have no memory fields
+            rss += int(status.get("VmRSS", "0 kB").split()[0]) * 1024
+            rss_peak += int(status.get("VmHWM", "0 kB").split()[0]) * 1024
+        with self.lock:
+            if self.cpu_start is None:
+                self.cpu_start = (cpu_user, cpu_system)
+            self.samples.append(
+                (
+                    ns_sample,
+                    round(cpu_user - self.cpu_start[0], 3),
+                    round(cpu_system - self.cpu_start[1], 3),
+                    rss,
+                    rss_peak,
+                    threads,
+                )
+            )
+            self.peak_rss = max(self.peak_rss, rss_peak if self.new_process else rss)
+
+    def run(self) -> None:
+        while True:
+            self.sample()
+            if self.stopped.wait(self.interval):
+                break
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        # the final sample covers the time since the last one, if still running
+        if PROC.joinpath(str(self.pid)).exists():
+            self.sample()
+
+    def get_rss(self) -> int:
+        with self.lock:
+            return self.samples[-1][SAMPLE_RSS] if self.samples else 0
+
+    def collect(self, result: Result) -> None:
+        with self.lock:
+            result.engine_samples = self.samples
+            result.engine_peak_rss = self.peak_rss
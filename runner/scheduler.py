@@ -0,0 +1,60 @@
+from heapq import heapify, heapreplace
+from random import Random
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+SCHEDULES: Tuple[str, ...] = ("manifest", "interleaved", "longest")
+
+# The query identifier, query string, config path and replication of an execution
+Execution = Tuple[str, str, Path, int]
+
+
+class ExecutionScheduler:
+    """Orders the executions of an experiment before they are queued"""
+
+    def __init__(
+        self,
+        schedule: str,
+        seed: int,
+        durations: Dict[Tuple[str, str], float],
+        default: float,
+    ) -> None:
+        self.schedule: str = schedule
+        self.seed: int = seed
+        # Durations from previous runs by query and config path, with the mean of
+        # the known durations or the default used for pairs without history
+        self.durations: Dict[Tuple[str, str], float] = durations
+        self.default: float = (
+            sum(durations.values()) / len(durations) if durations else default
+        )
+
+    def get_duration(self, execution: Execution) -> float:
+        return self.durations.get((execution[0], execution[2].as_posix()), self.default)
+
+    def order(self, executions: List[Execution]) -> List[Execution]:
+        if self.schedule == "interleaved":
+            # Every replication round is shuffled, so that the replications of a
+            # pair are spread over the experiment instead of running back-to-back
+            random: Random = Random(self.seed)
+            rounds: Dict[int, List[Execution]] = {}
+            for execution in executions:
+                rounds.setdefault(execution[3], []).append(execution)
+            ordered: List[Execution] = []
+            for replication in sorted(rounds):
+                random.shuffle(rounds[replication])
+                ordered.extend(rounds[replication])
+            return ordered
+        if self.schedule == "longest":
+            # Longest processing time first, so that the workers finish together
+            return sorted(
+                executions, key=lambda execution: -self.get_duration(execution)
+            )
+        return list(executions)
+
+    def get_makespan(self, executions: List[Execution], workers: int) -> float:
+        """Predicted duration when every execution goes to the first free worker"""
+        finish_times: List[float] = [0.0] * max(workers, 1)
+        heapify(finish_times)
+        for execution in executions:
+            heapreplace(finish_times, finish_times[0] + self.get_duration(execution))
+        return max(finish_times)
@@ -4,15 +4,24 @@ from typing import Dict
 from pathlib import Path
 from sys import stdout
 
+from runner.outputparser import PARSE_MODES
+
 log_levels: Dict[str, int] = {"info": INFO, "error": ERROR, "debug": DEBUG}
 
 
 class ArgumentNamespace(Namespace):
     log_level: str
     log_file: Path | None
+    workers: int
+    parse: str
+    resume: bool
+    force: bool
     experiment: Path | None
     plot: Path | None
     create: Path | None
+    index: Path | None
+    plot_points: int
+    plot_per_query: bool
 
 
 def setup_logging(level: str, path: Path | None) -> None:
@@ -43,10 +52,50 @@ def parse_arguments() -> ArgumentNamespace:
 
     parser.add_argument("--log-file", required=False, type=Path)
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of concurrent query executions",
+    )
+
+    parser.add_argument(
+        "--parse",
+        choices=PARSE_MODES,
+        default="deferred",
+        help="Parse engine output after the execution or while reading it",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip executions completed by a previous run",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Execute again even when results with the same fingerprint exist",
+    )
+
+    parser.add_argument(
+        "--plot-points",
+        type=int,
+        default=2000,
+        help="Maximum number of points to plot per curve",
+    )
+
+    parser.add_argument(
+        "--plot-per-query",
+        action="store_true",
+        help="Plot every query into its own file in parallel",
+    )
+
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--create", type=Path, help="Create experiment manifest at path")
     group.add_argument("--experiment", type=Path, help="Path to an experiment manifest")
     group.add_argument("--plot", type=Path, help="Path to query result file to plot")
+    group.add_argument("--index", type=Path, help="Rebuild index of a results path")
 
     args = parser.parse_args(namespace=ArgumentNamespace)
 
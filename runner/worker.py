@@ -0,0 +1,65 @@
+from pathlib import Path
+from typing import List
+from logging import exception
+from datetime import timedelta
+
+from experiment.experiment import Experiment
+from experiment.result import Result
+
+from runner.queryengine import QueryEngine
+from runner.proxyserver import BaseProxyServer, ProxySession
+
+
+class ExperimentWorker:
+    def __init__(
+        self,
+        index: int,
+        experiment: Experiment,
+        proxy_server: BaseProxyServer,
+        query_engine: QueryEngine,
+    ) -> None:
+        self.index: int = index
+        self.proxy_server: BaseProxyServer = proxy_server
+        self.query_engine: QueryEngine = query_engine
+        # The engine context refers to the proxy as configured in the manifest, and
+        # is pointed at a session-specific base URL for every execution instead,
+        # so that a single proxy can attribute requests from concurrent engines
+        self.proxy_base: str = (
+            f"http://{experiment.proxy_server_host}:{experiment.proxy_server_port}"
+        )
+
+    def execute_query(
+        self,
+        query_id: str,
+        query_string: str,
+        config_path: Path,
+        timeout: timedelta,
+        replication: int = 0,
+        node_args: List[str] | None = None,
+    ) -> Result | None:
+        session: str = self.proxy_server.open_session(replication)
+        try:
+            result: Result = self.query_engine.query_bindings(
+                query_id=query_id,
+                query_string=query_string,
+                timeout=timeout,
+                config_path=config_path,
+                rebase=(
+                    self.proxy_base,
+                    self.proxy_server.get_session_base(session),
+                ),
+                node_args=node_args,
+            )
+            proxy_session: ProxySession = self.proxy_server.close_session(session)
+            result.urls = proxy_session.urls
+            result.url_timings = proxy_session.requests
+            result.proxy_pool_hits = proxy_session.pool_hits
+            result.proxy_pool_misses = proxy_session.pool_misses
+            result.proxy_cache_hits = proxy_session.cache_hits
+            result.proxy_cache_misses = proxy_session.cache_misses
+            if self.proxy_server.network:
+                result.proxy_network = self.proxy_server.network.as_dict()
+            return result
+        except Exception as ex:
+            self.proxy_server.close_session(session)
+            exception(ex)
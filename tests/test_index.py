@@ -0,0 +1,68 @@
+from pathlib import Path
+from sqlite3 import connect
+from typing import Any, Dict, Tuple
+
+from experiment.index import INDEX_COLUMNS, ResultIndex, get_index_row, rebuild_index
+from experiment.result import Result, save_result
+
+# The columns of an index created before any columns were added to it
+OLD_COLUMNS: Tuple[str, ...] = (
+    "path TEXT PRIMARY KEY",
+    "config TEXT",
+    "query TEXT",
+    "replication INTEGER",
+    "time_begin TEXT",
+    "time_end TEXT",
+    "time_taken_seconds REAL",
+    "timeout INTEGER",
+    "result_count INTEGER",
+    "result_count_unique INTEGER",
+    "result_hash TEXT",
+    "requested_urls_count INTEGER",
+    "requested_urls_count_unique INTEGER",
+)
+
+
+def test_migrated_index_round_trips_every_column(tmp_path: Path) -> None:
+    with connect(tmp_path.joinpath("index.sqlite")) as connection:
+        connection.execute(f"CREATE TABLE executions ({', '.join(OLD_COLUMNS)})")
+    summary: Dict[str, Any] = {
+        "engine_config": "file:///config.json",
+        "engine_query": "file:///queries.sparql#0",
+        "replication": 1,
+        "time_begin": "2026-01-01T00:00:00Z",
+        "time_end": "2026-01-01T00:00:01Z",
+        "time_taken_seconds": 1.0,
+        "engine_timeout_reached": False,
+        "result_count": 3,
+        "result_count_unique": 2,
+        "result_hash": "0123456789abcdef0123456789abcdef",
+        "result_hash_version": 2,
+        "requested_urls_count": 4,
+        "requested_urls_count_unique": 3,
+        "engine_fingerprint": "f" * 64,
+        "schedule": "interleaved",
+        "schedule_seed": 42,
+    }
+    path: Path = tmp_path.joinpath("20260101T000000000000Z.json")
+    index: ResultIndex = ResultIndex(tmp_path)
+    index.add_rows((get_index_row(path, summary),))
+    rows = index.select("SELECT * FROM executions")
+    index.close()
+    assert len(rows) == 1
+    for name, _, key in INDEX_COLUMNS:
+        assert rows[0][name] == (path.name if key == "path" else summary[key]), name
+
+
+def test_rebuild_index_only_reads_results(tmp_path: Path) -> None:
+    result: Result = Result(config="file:///config.json", query="q#0")
+    result.begin()
+    result.add_result(0, {"a": {"value": "b"}})
+    result.end()
+    result_path: Path = save_result(tmp_path, result)
+    # a copy of a summary under another name is not a result of the experiment
+    tmp_path.joinpath("export.json").write_text(result_path.read_text())
+    index: ResultIndex = rebuild_index(tmp_path, processes=1)
+    rows = index.select("SELECT path FROM executions")
+    index.close()
+    assert list(row["path"] for row in rows) == [result_path.name]